@@ -1,11 +1,22 @@
 import streamlit as st
 import os
-import shutil
-import fitz
-import tempfile
+import cert_signing
+import fleet
+import jobs
+import log_view
+import secrets
 import datetime
-import pandas as pd
-from openpyxl import Workbook, load_workbook
+import lazy_import
+import pdf_server
+import qtg_signing
+import search_index
+import signer_profiles
+import signing_log
+import thumbnails
+import timing
+from qtg_core import QTGSet
+
+pd = lazy_import.module("pandas")
 
 
 
@@ -16,140 +27,450 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded",
 )
+timing_run = timing.begin_run({}, previous=st.session_state.get("timing_run"))
+st.session_state["timing_run"] = timing_run
 
 st.sidebar.header("QTG Review System")
 st.sidebar.markdown("Manage and review your QTG files efficiently.")
 device = st.sidebar.selectbox("Select Device", options=["Select", "FFS", "FTD"], key="device_selection")
 year = st.sidebar.selectbox("Select Year", options=["Select", "2024"], key="year_selection")
 set = st.sidebar.selectbox("Select Set", options=["Select", "Set A", "Set B"], key="set_selection")
+show_timing = st.sidebar.toggle("Show timing", key="show_timing")
+
+
+@st.cache_resource
+def get_search_index():
+    return search_index.SearchIndex()
+
+search = get_search_index()
+search.refresh_in_background()
+search_query = st.sidebar.text_input("🔎 Search all QTGs", key="search_query", placeholder="Words in a QTG or a remark")
+if search_query:
+    hits = search.search(search_query)
+    with st.sidebar.expander(f"{len(hits)} result(s)", expanded=True):
+        for kind, hit_device, hit_year, hit_set, hit_state, hit_name, snippet in hits:
+            where = f"{hit_device}/{hit_year}/{hit_set} · {hit_state or 'signing log'}"
+            st.markdown(f"**{hit_name}**  \n{where}  \n{' '.join(snippet.split())}")
+        if not hits:
+            st.caption("Nothing found yet; new files are indexed in the background.")
+
+
+
+@st.cache_resource
+def get_fleet_stats():
+    return fleet.FleetStats()
+
+def show_fleet_dashboard():
+    """Counts for every device/year/set, kept up to date incrementally."""
+    stats = get_fleet_stats()
+    stats.refresh()
+    st.header("📈 Fleet Overview")
+    states = stats.state_table().rename(columns={
+        "device": "Device", "year": "Year", "set_name": "Set",
+        "source": "Pending", "pass": "Passed", "fail": "Failed", "signed": "CAE signed",
+        "countersigned": "EAT signed",
+    })
+    for column, label in zip(st.columns(5), ["Pending", "Passed", "Failed", "CAE signed", "EAT signed"]):
+        column.metric(label, int(states[label].sum()))
+    st.dataframe(states, hide_index=True, use_container_width=True)
+    by_signer, by_day = st.columns(2)
+    with by_signer:
+        st.subheader("Signatures by signer")
+        st.dataframe(
+            stats.signer_table().rename(columns={
+                "signer": "Signer", "device": "Device", "year": "Year", "set_name": "Set", "signed": "Signed",
+            }),
+            hide_index=True,
+            use_container_width=True,
+        )
+    with by_day:
+        st.subheader("Signatures by day")
+        daily = stats.daily_table()
+        if daily.empty:
+            st.caption("No signatures yet.")
+        else:
+            st.bar_chart(daily, x="day", y="signed")
+
 if device == "Select" or year == "Select" or set == "Select":
     st.sidebar.warning("Please select a device, year, and set to proceed.")
     st.write("### Please select a device, year, and respective QTG set in the sidebar to continue.")
+    show_fleet_dashboard()
+    timing.finish_run(timing_run)
     st.stop()  
 
 base_folder = os.path.join(f"./{device}", year, set)
-source_folder = os.path.join(base_folder, "source_folder")
-pass_folder = os.path.join(base_folder, "pass_folder")
-fail_folder = os.path.join(base_folder, "fail_folder")
-signed_folder = os.path.join(base_folder, "signed_folder")
-log_file = os.path.join(base_folder, "signing_log.xlsx") 
+timing_run.labels["set"] = f"{device}/{year}/{set}"
+
+
+@st.cache_resource
+def get_qtg_set(base_folder):
+    return QTGSet(base_folder)
+
+
+@st.cache_resource
+def get_job_queue():
+    """One job queue per server process; it resumes interrupted jobs on start."""
+    return jobs.JobQueue()
+
+qtg_set = get_qtg_set(base_folder)
+job_queue = get_job_queue()
+job_queue.register(qtg_set)
+index = qtg_set.index
+source_folder = qtg_set.source_folder
+pass_folder = qtg_set.pass_folder
+fail_folder = qtg_set.fail_folder
+signed_folder = qtg_set.signed_folder
+log_file = qtg_set.log_file
 
-for folder in [source_folder, pass_folder, fail_folder, signed_folder]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+GALLERY_STATES = ["source", "pass", "fail"]
 
 
+def reconcile_index():
+    """Pick up what other reviewers changed on disk; every rerun, full or fragment, starts here."""
+    for state in index.reconcile():
+        if state in GALLERY_STATES:
+            thumbnails.prewarm(index.entries(index.folders[state]))
+
+reconcile_index()
+
+
+@st.cache_resource
+def prewarm_thumbnails(base_folder):
+    """Queue thumbnails for the whole set the first time this process opens it."""
+    for state in GALLERY_STATES:
+        thumbnails.prewarm(index.entries(index.folders[state]))
+
+prewarm_thumbnails(base_folder)
+
 
 def list_files(folder):
     """List files in a folder."""
-    try:
-        return os.listdir(folder)
-    except FileNotFoundError:
-        return []
+    return qtg_set.list_files(folder)
 
 def move_file(src, dest):
     try:
-        shutil.move(src, dest)
+        qtg_set.move_file(src, dest)
         return True
     except Exception as e:
         st.error(f"Error moving file {src} to {dest}: {e}")
         return False
 
 def retrieve_files(selected_files, src_folder, dest_folder):
-    moved_files = []
-    for item in selected_files:
-        src_path = os.path.join(src_folder, item)
-        dest_path = os.path.join(dest_folder, item)
-        try:
-            shutil.move(src_path, dest_path)
-            moved_files.append(item)
-        except Exception as e:
-            st.error(f"Error moving file {item} from {src_folder} to {dest_folder}: {e}")
+    moved_files, failures = qtg_set.retrieve_files(selected_files, src_folder, dest_folder)
+    for item, e in failures:
+        st.error(f"Error moving file {item} from {src_folder} to {dest_folder}: {e}")
     return moved_files
 
-def update_excel_log_with_remarks(excel_path, file_name, signer_name, signing_date, remarks):
-    try:
-        workbook = load_workbook(excel_path)
-        sheet = workbook.active
-        for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row):
-            if row[1].value == file_name: 
-                row[8].value = signer_name 
-                row[9].value = signing_date 
-                row[10].value = remarks 
-                workbook.save(excel_path)
-                workbook.close()
-                return True
-        st.error(f"File '{file_name}' not found in Excel log.")
-        return False
-
-    except Exception as e:
-        st.error(f"Error updating Excel log: {e}")
-        return False
-
-def add_signature_and_update_log(pdf_path, signature_path, signed_folder, signer_name, excel_path, remarks):
+def flash(kind, message):
+    """Queue a message to show after the next rerun."""
+    st.session_state.setdefault("flash_messages", []).append((kind, message))
+
+def show_flash_messages():
+    for kind, message in st.session_state.pop("flash_messages", []):
+        getattr(st, kind)(message)
+
+JOB_POLL_SECONDS = 1.0
+
+# What each tab shows.  An action in a tab reruns only that tab unless it
+# changed something another tab shows too.
+TAB_DATA = {
+    "manage": {"source", "pass", "fail"},
+    "retrieve": {"pass", "fail"},
+    "esign": {"pass", "signed", "countersigned"},
+    "signing_log": {"log"},
+}
+
+def fragment_rerun():
+    """Whether a fragment is rerunning on its own, after the full run finished."""
+    return timing_run.finished
+
+def tab_fragment(tab):
+    """Run a tab as a fragment, so its widgets rerun only that tab.
+
+    Inside a full rerun the tab is a span of that run; rerun on its own it
+    is timed as a run of its own, labelled with the tab.
+    """
+    def decorate(body):
+        def run():
+            if not fragment_rerun():
+                with timing.span(f"tab.{tab}"):
+                    body()
+                return
+            fragment_run = timing.begin_run({**timing_run.labels, "fragment": f"tab.{tab}"})
+            try:
+                # A fragment rerun skips the top of the script, reconcile included.
+                reconcile_index()
+                with timing.span(f"tab.{tab}"):
+                    body()
+            finally:
+                timing.finish_run(fragment_run)
+        return st.fragment(run)
+    return decorate
+
+def refresh_after(tab, *changed):
+    """Rerun after an action in tab that changed the given data."""
+    shown_elsewhere = any(not TAB_DATA[other].isdisjoint(changed) for other in TAB_DATA if other != tab)
+    st.rerun(scope="fragment" if fragment_rerun() and not shown_elsewhere else "app")
+
+def queue_job(kind, label, selection_key=None, secrets=None, **params):
+    """Hand an operation to the background queue and track it in this session."""
+    job_id = job_queue.submit(kind, base_folder, secrets=secrets, label=label, **params)
+    st.session_state.setdefault("jobs", []).append(job_id)
+    if selection_key:
+        st.session_state.pop(selection_key, None)
+    # Nothing has changed yet; the job poller reruns the app when the job
+    # ends.  Only start the poller if it is not already running.
+    st.rerun(scope="fragment" if fragment_rerun() and jobs_polling else "app")
+
+def report_job(job):
+    label = job.params["label"]
+    if job.status == "failed":
+        flash("error", f"{label} failed: {job.error}")
+        return
+    done, failures = job.result["done"], job.result["failures"]
+    if done:
+        flash("success", f"{label}: {len(done)} of {len(job.params['names'])} done.")
+    for name, error in failures:
+        flash("error", f"{label}: could not process '{name}': {error}")
+    if job.kind == "sign":
+        st.session_state.pop("signed_download", None)
+        if len(job.result["signed"]) == 1:
+            st.session_state["signed_download"] = job.result["signed"][0]
+
+def show_jobs():
+    """Progress for this session's background jobs; finished ones are reported once."""
+    finished = False
+    for job_id in list(st.session_state.get("jobs", [])):
+        job = job_queue.get(job_id)
+        if job is None or job.status not in jobs.ACTIVE:
+            st.session_state["jobs"].remove(job_id)
+            if job is not None:
+                report_job(job)
+                finished = True
+            continue
+        fraction = job.done / job.total if job.total else 0.0
+        st.progress(fraction, text=f"{job.params['label']}: {job.done} of {job.total} ({job.status})")
+    others = len(job_queue.active(base_folder)) - len(st.session_state.get("jobs", []))
+    if others > 0:
+        st.caption(f"{others} other background job(s) are running on this set.")
+    if finished:
+        st.rerun()
+
+def pdf_link(label, path, download=False):
+    """Link to a PDF that is streamed from disk only when the user opens it."""
+    if pdf_server.start():
+        session_id = st.session_state.setdefault("pdf_session_id", secrets.token_hex(8))
+        url = pdf_server.url_for(path, session_id, host=st.context.headers.get("Host"), download=download)
+        st.link_button(label, url)
+    else:
+        # The file server could not bind its port; fall back to inline bytes.
+        with open(path, "rb") as pdf_file:
+            st.download_button(label, data=pdf_file, file_name=os.path.basename(path), mime="application/pdf")
+
+GALLERY_PAGE_SIZE = 24
+GALLERY_COLUMNS = 6
+
+def show_gallery(folder_path):
+    """Show cached first-page thumbnails; missing ones render in the background."""
+    entries = index.entries(folder_path)
+    pages = max(1, -(-len(entries) // GALLERY_PAGE_SIZE))
+    page = page_number("Page", pages, f"gallery_page_{folder_path}")
+    visible = entries[(page - 1) * GALLERY_PAGE_SIZE:page * GALLERY_PAGE_SIZE]
+    missing = []
+    for row_start in range(0, len(visible), GALLERY_COLUMNS):
+        row = visible[row_start:row_start + GALLERY_COLUMNS]
+        for column, entry in zip(st.columns(GALLERY_COLUMNS), row):
+            name = os.path.basename(entry[0])
+            thumbnail = thumbnails.cached_thumbnail(*entry)
+            with column:
+                if thumbnail:
+                    st.image(thumbnail, caption=name)
+                elif thumbnails.failed_thumbnail(*entry):
+                    st.caption(f"⚠️ {name} (no preview)")
+                else:
+                    st.caption(f"⏳ {name}")
+                    missing.append(entry)
+    if missing:
+        thumbnails.prewarm(missing)
+        st.caption("Some previews are still rendering and will appear on the next refresh.")
+
+def show_viewer(folder_path, name):
+    """Show one page of a PDF rendered on the server; the next pages render ahead."""
+    path = os.path.join(folder_path, name)
     try:
-        current_datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        doc = fitz.open(pdf_path)
-        signature_img = fitz.open(signature_path)
-        page = doc[0]
-        image_rect = fitz.Rect(50, 20, 200, 170)  
-        page.insert_image(image_rect, filename=signature_path)
-        text_rect = fitz.Rect(50, 180, 250, 200)
-        page.insert_text(text_rect.tl, f"Signed on: {current_datetime}", fontsize=10)
-        signed_file_path = os.path.join(signed_folder, os.path.basename(pdf_path))
-        doc.save(signed_file_path)
-        doc.close()
-
-        file_name = os.path.basename(pdf_path).replace(".pdf", "")  
-        if update_excel_log_with_remarks(excel_path, file_name, signer_name, current_datetime, remarks):
-            st.success(f"Signed {file_name} and updated the log successfully!")
-            os.remove(pdf_path)  
-            return signed_file_path
-
-    except Exception as e:
-        st.error(f"Error during signing: {e}")
-        return None
+        stat = os.stat(path)
+    except FileNotFoundError:
+        st.warning(f"'{name}' was moved by another reviewer.")
+        return
+    row = (name, stat.st_size, stat.st_mtime_ns)
+    pages = index.metadata(folder_path, [row])[name][0]
+    if not pages:
+        st.warning(f"'{name}' could not be opened.")
+        return
+    page_column, zoom_column = st.columns(2)
+    with page_column:
+        page = page_number(f"Page (of {pages})", pages, f"viewer_page_{path}")
+    with zoom_column:
+        zoom = st.select_slider(
+            "Zoom", thumbnails.PAGE_ZOOMS, value=thumbnails.PAGE_ZOOMS[0], key="viewer_zoom",
+            format_func=lambda zoom: f"{zoom:.0%}",
+        )
+    with timing.span("pdf.page"):
+        png = thumbnails.page_image(path, stat.st_size, stat.st_mtime_ns, page - 1, zoom, pages)
+    st.image(png, caption=f"{name} — page {page} of {pages}")
+
+LIST_PAGE_SIZE = 50
+LIST_SORTS = {"Name": "name", "Size": "size", "Modified": "modified"}
+SELECT_LIMIT = 200
+
+def page_number(label, pages, key):
+    """A page picker that stays in range when the list shrinks."""
+    if pages <= 1:
+        return 1
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    return st.number_input(label, min_value=1, max_value=pages, key=key)
+
+def find_files(folder_path, label, key, names=None):
+    """Filter a folder by name and return at most SELECT_LIMIT matching names.
+
+    Pass names to filter a list already read from the index, such as a
+    stage queue, instead of the whole folder.
+    """
+    name_filter = st.text_input(label, key=key, placeholder="Type part of a file name")
+    if names is None:
+        matches = index.count(folder_path, name_filter)
+        names = [name for name, _, _ in index.page(folder_path, limit=SELECT_LIMIT, name_filter=name_filter)]
+    else:
+        names = [name for name in names if name_filter.lower() in name.lower()]
+        matches = len(names)
+        names = names[:SELECT_LIMIT]
+    if matches > len(names):
+        st.caption(f"Showing the first {len(names)} of {matches} matches; type to narrow the list.")
+    elif name_filter and not names:
+        st.caption("No files match.")
+    return names
+
+def create_file_dataframe(folder_path, status, offset=0, sort="name", descending=False, name_filter=""):
+    """One page of a folder listing; page counts are read for these rows only."""
+    rows = index.page(folder_path, offset, LIST_PAGE_SIZE, sort, descending, name_filter)
+    metadata = index.metadata(folder_path, rows)
+    return pd.DataFrame(
+        [
+            (
+                name,
+                size / 1024,
+                datetime.datetime.fromtimestamp(mtime_ns / 1e9),
+                metadata[name][0],
+                metadata[name][1],
+                status,
+            )
+            for name, size, mtime_ns in rows
+        ],
+        columns=["File Name", "Size (KB)", "Modified", "Pages", "Title", "Status"],
+    )
 
-def create_file_dataframe(folder_path):
-    folder_contents = list_files(folder_path)
-    if folder_contents: 
-        data = [[item] for item in folder_contents]
-        return pd.DataFrame(data, columns=["File Name"])
-    else: 
-        return pd.DataFrame(columns=["File Name"])
+def show_file_list(folder_path, status):
+    key = f"list_{folder_path}"
+    filter_column, sort_column, order_column = st.columns([3, 1, 1])
+    name_filter = filter_column.text_input("Filter by name", key=f"{key}_filter")
+    sort = sort_column.selectbox("Sort by", list(LIST_SORTS), key=f"{key}_sort")
+    descending = order_column.toggle("Descending", key=f"{key}_descending")
+    total = index.count(folder_path, name_filter)
+    if not total:
+        st.write("No matching files.")
+        return
+    page = page_number("Page", -(-total // LIST_PAGE_SIZE), f"{key}_page")
+    offset = (page - 1) * LIST_PAGE_SIZE
+    folder_data = create_file_dataframe(folder_path, status, offset, LIST_SORTS[sort], descending, name_filter)
+    st.dataframe(
+        folder_data,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Size (KB)": st.column_config.NumberColumn(format="%.1f"),
+            "Modified": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+        },
+    )
+    st.caption(f"Files {offset + 1}-{offset + len(folder_data)} of {total}")
+
+def show_log_grid(log_file):
+    """The signing log, filtered and sorted on the server; only one page is sent."""
+    table = log_view.log_table(log_file)
+    signer_column, dates_column, status_column, stage_column = st.columns([2, 2, 1, 1])
+    signer_names = signer_column.multiselect("Signer", log_view.signers(table), key="log_signers")
+    bounds = log_view.date_bounds(table)
+    dates = None
+    if bounds:
+        chosen = dates_column.date_input(
+            "Signed between", value=[], min_value=bounds[0], max_value=bounds[1], key="log_dates"
+        )
+        if len(chosen) == 2:
+            dates = chosen
+    statuses = status_column.multiselect("Status", list(log_view.STATUS_FILTERS), key="log_status")
+    stages = stage_column.multiselect("Stage", log_view.STAGE_FILTERS, key="log_stage")
+    sort_column, order_column = st.columns([3, 1])
+    columns = [name for name in table.column_names if name not in log_view.HIDDEN_COLUMNS]
+    sort = sort_column.selectbox("Sort by", ["Log order", *columns], key="log_sort")
+    descending = order_column.toggle("Descending", key="log_descending")
+
+    matching = log_view.select(table, signer_names, dates, statuses, stages)
+    total = matching.num_rows
+    if not total:
+        st.write("No matching log entries.")
+        return
+    page = page_number("Page", -(-total // log_view.PAGE_SIZE), "log_page")
+    offset = (page - 1) * log_view.PAGE_SIZE
+    log_page = log_view.page(matching, None if sort == "Log order" else sort, descending, offset)
+    st.dataframe(log_view.styled(log_page), hide_index=True, use_container_width=True)
+    st.caption(f"Rows {offset + 1}-{offset + len(log_page)} of {total}")
+
+jobs_polling = bool(st.session_state.get("jobs"))
+st.fragment(run_every=JOB_POLL_SECONDS if jobs_polling else None)(show_jobs)()
+show_flash_messages()
 
 tab1, tab2, tab3, tab4 = st.tabs(
     ["📂 Manage QTG Files", "🔄 Retrieve Files", "🖊️ E-Sign Document", "📊 Signing Log"]
 )
 
-with tab1:
+@tab_fragment("manage")
+def manage_tab():
     st.subheader("📁 QTG Review and Classification")
 
     with st.container():
-        files = list_files(source_folder)
-
-        if files:
+        if index.count(source_folder):
+            files = find_files(source_folder, "Find a QTG", "review_filter")
             file_to_move = st.selectbox("Select the QTG to review", files)
             if file_to_move:
                 pdf_file_path = os.path.join(source_folder, file_to_move)
                 if os.path.exists(pdf_file_path):
-                    with open(pdf_file_path, "rb") as pdf_file:
-                        pdf_data = pdf_file.read()
-                        st.download_button(
-                            label="📂 Open PDF",
-                            data=pdf_data,
-                            file_name=file_to_move,
-                            mime="application/pdf",
-                        )
+                    pdf_link("📂 Open PDF", pdf_file_path)
+                    if st.toggle("👁 Preview here", key="viewer_on"):
+                        show_viewer(source_folder, file_to_move)
             status = st.radio("Status of QTG", ["Pass", "Fail"], horizontal=True)
-            if st.button("Submit"):
+            if st.button("Submit") and file_to_move:
                 destination_folder = pass_folder if status == "Pass" else fail_folder
                 src_path = os.path.join(source_folder, file_to_move)
                 dest_path = os.path.join(destination_folder, file_to_move)
 
                 if move_file(src_path, dest_path):
-                    st.success(f"Moved '{file_to_move}' to **{'Pass' if status == 'Pass' else 'Fail'}** folder.")
-                    st.rerun()
+                    flash("success", f"Moved '{file_to_move}' to **{'Pass' if status == 'Pass' else 'Fail'}** folder.")
+                    refresh_after("manage", "source", status.lower())
+
+            with st.expander("Bulk triage"):
+                bulk_files = st.multiselect("Select QTGs", files, key="bulk_triage_files")
+                bulk_status = st.radio(
+                    "Move selected QTGs to", ["Pass", "Fail"], horizontal=True, key="bulk_triage_status"
+                )
+                if st.button("Move Selected", key="bulk_triage_submit") and bulk_files:
+                    queue_job(
+                        "move",
+                        f"Moving {len(bulk_files)} file(s) to {bulk_status}",
+                        "bulk_triage_files",
+                        names=bulk_files,
+                        src="source",
+                        dest=bulk_status.lower(),
+                    )
         else:
             st.warning("🚫 No files to move in the source folder.")
 
@@ -176,13 +497,16 @@ with tab1:
         current_folder = folder_map[selected_folder]
 
         st.markdown(f"### Files in {selected_folder}")
-        folder_data = create_file_dataframe(current_folder)
-        if not folder_data.empty:
-            st.dataframe(folder_data)
-        else:
+        folder_view = st.radio("View as", ["List", "Gallery"], horizontal=True, key="folder_view1")
+        if not index.count(current_folder):
             st.write(f"No files in {selected_folder.lower()}.")
+        elif folder_view == "Gallery":
+            show_gallery(current_folder)
+        else:
+            show_file_list(current_folder, selected_folder.replace(" Folder", ""))
 
-with tab2:
+@tab_fragment("retrieve")
+def retrieve_tab():
     st.header("🔄 Retrieve Files to Source Folder")
 
     selected_folder = st.segmented_control(
@@ -193,23 +517,29 @@ with tab2:
  
     if selected_folder:
         folder_path = pass_folder if selected_folder == "Pass Folder" else fail_folder
-        folder_files = list_files(folder_path)
-
-        if folder_files:
+        if index.count(folder_path):
             
             st.markdown(f"### 📂 Files in {selected_folder}")
-            file_to_retrieve = st.radio(
-                "Select a file to retrieve:",
-                options=folder_files,
-                key=f"{selected_folder}_radio", 
-            )
-
-            if st.button(f"Retrieve Selected File from {selected_folder}"):
-                with st.spinner("Retrieving file..."):
-                    moved_files = retrieve_files([file_to_retrieve], folder_path, source_folder)
-                if moved_files:
-                    st.success(f"Successfully moved '{file_to_retrieve}' to the Source folder!")
-                    st.rerun()  
+            retrieve_all = st.checkbox(f"Select everything in the {selected_folder}", key=f"{selected_folder}_all")
+            if retrieve_all:
+                files_to_retrieve = list_files(folder_path)
+            else:
+                files_to_retrieve = st.multiselect(
+                    "Select files to retrieve:",
+                    options=find_files(folder_path, "Find files to retrieve", f"{selected_folder}_filter"),
+                    key=f"{selected_folder}_retrieve",
+                )
+
+            if st.button(f"Retrieve Selected Files from {selected_folder}"):
+                if files_to_retrieve:
+                    queue_job(
+                        "move",
+                        f"Retrieving {len(files_to_retrieve)} file(s) from {selected_folder}",
+                        f"{selected_folder}_retrieve",
+                        names=files_to_retrieve,
+                        src=index.state_of(folder_path),
+                        dest="source",
+                    )
                 else:
                     st.warning("No file was moved.")
         else:
@@ -217,43 +547,144 @@ with tab2:
     else:
         st.info("Please select a folder to view its files.")
 
-with tab3:
+@tab_fragment("esign")
+def esign_tab():
     st.header("🖊️ E-Sign Document")
 
-    pass_files = list_files(pass_folder)
-
-    if pass_files:
-        file_to_sign = st.selectbox("Select a document to sign", pass_files)
-        selected_file_path = os.path.join(pass_folder, file_to_sign)
+    stage = st.radio(
+        "Review stage", qtg_signing.STAGES, horizontal=True, key="sign_stage",
+        format_func=lambda stage: f"{stage} ({len(qtg_set.stage_queue(stage))} waiting)",
+    )
+    queued_files = qtg_set.stage_queue(stage)
+
+    if queued_files:
+        sign_mode = st.radio("Signing mode", ["Single document", "Batch"], horizontal=True, key="sign_mode")
+        if sign_mode == "Single document":
+            file_to_sign = st.selectbox(
+                "Select a document to sign",
+                find_files(qtg_set.stage_folders(stage)[0], "Find a document", "sign_filter", queued_files),
+            )
+        else:
+            sign_all = st.checkbox(f"Sign everything waiting for {stage} ({len(queued_files)})", key="sign_all")
+            files_to_sign = queued_files if sign_all else st.multiselect(
+                "Select documents to sign",
+                find_files(qtg_set.stage_folders(stage)[0], "Find documents", "sign_filter", queued_files),
+                key="files_to_sign",
+            )
 
+        signer_name = st.text_input("Enter your name", key="signer_name")
+        signer_pin = st.text_input(
+            "Signature PIN", type="password", key="signer_pin",
+            help="Chosen when you first upload your signature; needed to use or replace it.",
+        )
+        saved_signature = signer_profiles.has_profile(signer_name)
+        unlocked = False
+        if saved_signature and signer_pin:
+            try:
+                signer_profiles.verify_pin(signer_name, signer_pin)
+                unlocked = True
+            except signer_profiles.ProfileLocked as e:
+                st.caption(str(e))
+        if unlocked:
+            st.image(signer_profiles.signature_bytes(signer_name), caption=f"Saved signature for {signer_name}", width=150)
         signature_image = st.file_uploader(
-            "Choose an image file for your signature", type=["png", "jpg", "jpeg"], key="signature_uploader"
+            "Replace your saved signature" if saved_signature else "Choose an image file for your signature",
+            type=["png", "jpg", "jpeg"],
+            key="signature_uploader",
         )
-        signer_name = st.text_input("Enter your name", key="signer_name")
+        certify, passphrase, certificate_file = False, "", None
+        if cert_signing.available():
+            with st.expander("🔏 Certificate signature (PAdES)"):
+                saved_certificate = signer_profiles.certificate_path(signer_name)
+                certificate_file = st.file_uploader(
+                    "Replace your certificate" if saved_certificate else "Your certificate (.p12 / .pfx)",
+                    type=["p12", "pfx"],
+                    key="certificate_uploader",
+                )
+                passphrase = st.text_input("Certificate passphrase", type="password", key="certificate_passphrase")
+                certify = st.toggle(
+                    "Also sign with my certificate",
+                    key="certify",
+                    disabled=not (signer_name and (saved_certificate and unlocked or certificate_file)),
+                    help="Documents certified at an earlier stage can only be signed with a certificate.",
+                )
+                if saved_certificate and unlocked and passphrase and not certificate_file:
+                    try:
+                        st.caption(f"Signing as {cert_signing.subject(cert_signing.load_signer(saved_certificate, passphrase))}")
+                    except cert_signing.CertificateError as e:
+                        st.caption(str(e))
         remarks = st.text_area("Add remarks (Optional)", height=150, key="remarks_input")
 
-        if st.button("Apply Signature") and signature_image and signer_name:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                tmp.write(signature_image.read())
-                signature_path = tmp.name
-            signed_file_path = add_signature_and_update_log(
-                selected_file_path, signature_path, signed_folder, signer_name, log_file, remarks
-            )
-            if signed_file_path:
-                st.success(f"Signed {file_to_sign} successfully!")
-                with open(signed_file_path, "rb") as file:
-                    st.download_button(
-                        "Download Signed Document",
-                        data=file,
-                        file_name=os.path.basename(signed_file_path),
-                        mime="application/pdf",
+        if st.button("Apply Signature") and (signature_image or unlocked) and signer_name:
+            names = ([file_to_sign] if file_to_sign else []) if sign_mode == "Single document" else files_to_sign
+            try:
+                if signature_image:
+                    signer_profiles.save_profile(signer_name, signature_image.getvalue(), signer_pin)
+                if certify and certificate_file:
+                    signer_profiles.save_certificate(signer_name, certificate_file.getvalue(), signer_pin)
+                if certify:
+                    # Opened once here and kept for this signer's later documents.
+                    cert_signing.load_signer(signer_profiles.certificate_path(signer_name), passphrase)
+            except (ValueError, signer_profiles.ProfileLocked) as e:
+                st.error(str(e))
+            else:
+                if names:
+                    queue_job(
+                        "sign",
+                        f"{stage} signing {names[0] if len(names) == 1 else f'{len(names)} documents'}",
+                        None if sign_mode == "Single document" else "files_to_sign",
+                        secrets={"passphrase": passphrase} if certify else None,
+                        names=names,
+                        signer_name=signer_name,
+                        remarks=remarks,
+                        certify=certify,
+                        stage=stage,
                     )
-    else:
+                else:
+                    st.warning("Select at least one document to sign.")
+    elif stage == qtg_signing.DEFAULT_STAGE:
         st.warning("No files available to sign in the Pass folder.")
+    else:
+        st.warning(f"No {qtg_signing.DEFAULT_STAGE}-signed documents are waiting for {stage}.")
 
-with tab4:
+    signed_download = st.session_state.get("signed_download")
+    if signed_download and os.path.exists(signed_download):
+        pdf_link("Download Signed Document", signed_download, download=True)
+
+@tab_fragment("signing_log")
+def signing_log_tab():
     st.header("📊 Signing Log")
 
-    log_data = pd.read_excel(log_file)
+    pending = signing_log.pending_entries(log_file)
+    if pending:
+        st.caption(f"{len(pending)} signature(s) recorded in the journal are not yet written to the Excel file.")
+        if st.button("Regenerate Excel log", key="regenerate_log"):
+            qtg_set.rebuild_log()
+            refresh_after("signing_log", "log")
+
+    show_log_grid(log_file)
 
-    st.dataframe(log_data)
+with tab1:
+    manage_tab()
+with tab2:
+    retrieve_tab()
+with tab3:
+    esign_tab()
+with tab4:
+    signing_log_tab()
+
+timing.finish_run(timing_run)
+if show_timing:
+    with st.sidebar.expander("⏱️ Timing", expanded=True):
+        st.write(f"This rerun: {timing_run.end - timing_run.start:.3f} s")
+        st.dataframe(
+            pd.DataFrame(timing_run.summary(), columns=["Operation", "Calls", "Seconds"]), hide_index=True
+        )
+        st.write("Recent reruns of this set")
+        st.dataframe(
+            pd.DataFrame(
+                timing.percentiles(timing_run.labels["set"]),
+                columns=["Operation", "Set", "Count", "p50", "p90", "p99"],
+            ).drop(columns="Set"),
+            hide_index=True,
+        )
@@ -0,0 +1,97 @@
+"""Time full reruns of the app and the share of each tab in them.
+
+    python benchmarks/bench_reruns.py --files 1000 --log-rows 20000 --repeat 10
+
+Runs app.py under Streamlit's AppTest against a synthetic set, with a
+folder listing, the PDF viewer and the signing log on screen.  A widget
+outside a fragment costs a full rerun; a widget inside a tab fragment costs
+only that tab's run, so "full_rerun" and the per-tab medians are the
+per-interaction latency before and after tabs became fragments.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synth_tree  # noqa: E402
+import thumbnails  # noqa: E402
+
+SESSION = {
+    "device_selection": "FFS",
+    "year_selection": "2024",
+    "set_selection": "Set A",
+    "folder_selection1": "Source Folder",
+    "folder_selection2": "Pass Folder",
+    "viewer_on": True,
+}
+TABS = ["tab.manage", "tab.retrieve", "tab.esign", "tab.signing_log"]
+
+
+def wait_for_background(timeout=600):
+    """Let the search index and thumbnail prewarm finish so they don't skew timings."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        searching = any(thread.name == "qtg-search-refresh" for thread in threading.enumerate())
+        if not searching and not thumbnails._in_flight:
+            return
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    synth_tree.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--dir", help="where to build the tree (defaults to a temporary directory)")
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+
+    with open(os.path.join(ROOT, "app.py")) as f:
+        # AppTest cannot drive segmented controls; radios take the same values.
+        source = f.read().replace("st.segmented_control(", "st.radio(")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        options = synth_tree.tree_options(args)
+        options.update(devices=["FFS"], years=["2024"], sets=1)
+        synth_tree.make_tree(root, **options)
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            app = AppTest.from_string(source, default_timeout=600)
+            for key, value in SESSION.items():
+                app.session_state[key] = value
+            app.run()
+            wait_for_background()
+            app.run()
+            totals, spans = [], {tab: [] for tab in TABS}
+            for _ in range(args.repeat):
+                app.run()
+                if app.exception:
+                    raise RuntimeError(app.exception[0].value)
+                run = app.session_state["timing_run"]
+                totals.append(run.end - run.start)
+                summary = {name: seconds for name, _, seconds in run.summary()}
+                for tab in TABS:
+                    spans[tab].append(summary.get(tab, 0.0))
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "params": vars(args),
+        "full_rerun_ms": round(statistics.median(totals) * 1000, 1),
+        "tab_ms": {tab: round(statistics.median(values) * 1000, 1) for tab, values in spans.items()},
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Compare the signing paths: full rewrite, incremental update, signer profile.
+
+    python benchmarks/bench_signing.py --pages 300 --runs 5
+
+Prints one JSON object per mode with latency and the bytes each mode wrote.
+Run it with --dir on the QTG storage to see whether clones are reflinks.
+With pyHanko installed it also signs --batch documents with a self-signed
+certificate, opening the PKCS#12 key per document, once, and once per
+worker process.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cert_signing  # noqa: E402
+import qtg_signing  # noqa: E402
+import signer_profiles  # noqa: E402
+
+
+def make_pdf(path, pages):
+    """Write a PDF whose pages each carry text and their own noise image."""
+    doc = fitz.open()
+    for number in range(pages):
+        noise = fitz.Pixmap(fitz.csRGB, 128, 128, os.urandom(128 * 128 * 3), False)
+        page = doc.new_page()
+        page.insert_text((72, 72), f"QTG benchmark page {number + 1}", fontsize=14)
+        page.insert_image(fitz.Rect(72, 100, 472, 500), pixmap=noise)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def make_signature(path):
+    """Write a camera-sized JPEG, like a photographed signature."""
+    width, height = 2400, 1600
+    row = bytes((x * 255 // width) for x in range(width) for _ in range(3))
+    pixmap = fitz.Pixmap(fitz.csRGB, width, height, row * height, False)
+    pixmap.save(path, jpg_quality=90)
+
+
+def make_certificate(path, passphrase, common_name="QTG Benchmark Signer"):
+    """Write a self-signed RSA certificate and key as a PKCS#12 file."""
+    import datetime
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.KeyUsage(
+            digital_signature=True, content_commitment=True, key_encipherment=False, data_encipherment=False,
+            key_agreement=False, key_cert_sign=False, crl_sign=False, encipher_only=False, decipher_only=False,
+        ), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    with open(path, "wb") as f:
+        f.write(pkcs12.serialize_key_and_certificates(
+            common_name.encode("utf-8"), key, certificate, None,
+            serialization.BestAvailableEncryption(passphrase.encode("utf-8")),
+        ))
+
+
+def written_bytes():
+    # wchar counts bytes this process asked the kernel to write, including
+    # in-kernel copies on some filesystems; a reflink adds nothing.
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def run(mode, pdf_path, signature, out_dir, runs):
+    latencies = []
+    written = []
+    for _ in range(runs):
+        before = written_bytes()
+        start = time.perf_counter()
+        signed_path, _ = qtg_signing.stamp_pdf(pdf_path, signature, out_dir, incremental=mode != "full")
+        latencies.append(time.perf_counter() - start)
+        after = written_bytes()
+        if before is not None:
+            written.append(after - before)
+        output_size = os.path.getsize(signed_path)
+        os.remove(signed_path)
+    return {
+        "mode": mode,
+        "runs": runs,
+        "latency_median_s": statistics.median(latencies),
+        "latency_min_s": min(latencies),
+        "bytes_written_median": statistics.median(written) if written else None,
+        "source_bytes": os.path.getsize(pdf_path),
+        "output_bytes": output_size,
+        "appended_bytes": output_size - os.path.getsize(pdf_path) if mode != "full" else None,
+    }
+
+
+def run_certified(mode, pdf_path, signature, out_dir, batch, certificate):
+    start = time.perf_counter()
+    if mode == "pades/pool":
+        results = list(qtg_signing.sign_batch(
+            [pdf_path] * batch, signature, out_dir, names=[f"{number}.pdf" for number in range(batch)],
+            certificate=certificate,
+        ))
+        errors = [error for _, _, _, error in results if error is not None]
+        if errors:
+            raise errors[0]
+    else:
+        signature = qtg_signing.insertable_signature(signature)
+        signer = cert_signing.load_signer(*certificate) if mode == "pades/key-reused" else None
+        for number in range(batch):
+            if mode == "pades/key-per-document":
+                signer = cert_signing.signers.SimpleSigner.load_pkcs12(
+                    certificate[0], passphrase=certificate[1].encode("utf-8")
+                )
+            qtg_signing.stamp_pdf(pdf_path, signature, out_dir, name=f"{number}.pdf", signer=signer)
+    elapsed = time.perf_counter() - start
+    for name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, name))
+    return {"mode": mode, "documents": batch, "total_s": elapsed, "per_document_s": elapsed / batch}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=20, help="documents per certificate-signing mode")
+    parser.add_argument("--dir", help="where to create files (defaults to a temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        pdf_path = os.path.join(work_dir, "qtg.pdf")
+        signature_path = os.path.join(work_dir, "signature.jpg")
+        out_dir = os.path.join(work_dir, "signed")
+        os.makedirs(out_dir)
+        make_pdf(pdf_path, args.pages)
+        make_signature(signature_path)
+        clone_method = qtg_signing.clone_file(pdf_path, os.path.join(out_dir, "probe"))
+        os.remove(os.path.join(out_dir, "probe"))
+        signer_profiles.PROFILE_DIR = os.path.join(work_dir, "profiles")
+        with open(signature_path, "rb") as f:
+            signer_profiles.save_profile("benchmark", f.read(), "benchmark")
+        signatures = {
+            "full": signature_path,
+            "incremental": signature_path,
+            "incremental+profile": signer_profiles.signature_stamp("benchmark"),
+        }
+        for mode, signature in signatures.items():
+            result = run(mode, pdf_path, signature, out_dir, args.runs)
+            result["pages"] = args.pages
+            if mode != "full":
+                result["clone_method"] = clone_method
+            print(json.dumps(result))
+
+        if cert_signing.available():
+            certificate = (os.path.join(work_dir, "signer.p12"), "benchmark")
+            make_certificate(*certificate)
+            with open(signature_path, "rb") as f:
+                signature_bytes = f.read()
+            for mode in ("pades/key-per-document", "pades/key-reused", "pades/pool"):
+                result = run_certified(mode, pdf_path, signature_bytes, out_dir, args.batch, certificate)
+                result["pages"] = args.pages
+                print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Check that starting the app stays within its import-time budget.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --budget-ms 150 --repeat 10 --output imports.json
+
+Imports the modules app.py imports, in fresh interpreters, after Streamlit
+itself.  Exits 1 when the median time for them exceeds --budget-ms or when
+one of them pulls in a library that should only load when a tab or job
+needs it (PyMuPDF, pandas, openpyxl, pyarrow, pyHanko).
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ["fitz", "pandas", "numpy", "openpyxl", "pyarrow", "pyhanko", "cryptography"]
+# Run in each fresh interpreter: time the app's imports on top of Streamlit,
+# then report which deferred libraries they loaded.
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import streamlit
+framework = set(sys.modules)
+middle = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+end = time.perf_counter()
+loaded = [name for name in {deferred!r} if name in sys.modules and name not in framework]
+print(json.dumps({{"streamlit_s": middle - start, "app_s": end - middle, "loaded": loaded}}))
+"""
+
+
+def app_imports(app_path):
+    """The modules app.py imports at top level, Streamlit excepted."""
+    with open(app_path) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return [name for name in dict.fromkeys(modules) if name.split(".")[0] != "streamlit"]
+
+
+def slowest_imports(importtime_output, count=10):
+    """The costliest imports directly below the app's modules, from -X importtime."""
+    rows = []
+    after_framework = False
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if not after_framework:
+            # Lines are printed as imports finish, so Streamlit's own comes last.
+            after_framework = depth == 0 and name.strip() == "streamlit"
+        elif depth <= 1:
+            rows.append((int(cumulative), name.strip()))
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:count]]
+
+
+def probe(modules, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE.format(modules=modules, deferred=DEFERRED)]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=250,
+                        help="median time allowed for the app's own imports, on top of Streamlit")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    args = parser.parse_args()
+
+    modules = app_imports(os.path.join(ROOT, "app.py"))
+    probe(modules)  # warm the filesystem and bytecode caches
+    runs = [probe(modules)[0] for _ in range(args.repeat)]
+    traced, importtime_output = probe(modules, importtime=True)
+
+    app_ms = statistics.median(run["app_s"] for run in runs) * 1000
+    loaded = sorted({name for run in runs + [traced] for name in run["loaded"]})
+    problems = []
+    if app_ms > args.budget_ms:
+        problems.append(f"app imports take {app_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    for name in loaded:
+        problems.append(f"{name} is imported at start-up; import it lazily where it is used")
+
+    document = {
+        "params": vars(args),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "modules": modules,
+        "streamlit_ms": round(statistics.median(run["streamlit_s"] for run in runs) * 1000, 1),
+        "app_ms": round(app_ms, 1),
+        "deferred_loaded": loaded,
+        "slowest": slowest_imports(importtime_output),
+        "problems": problems,
+    }
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for line in problems:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""Time the QTG workflow operations against a synthetic tree.
+
+    python benchmarks/run_benchmarks.py --files 1000 --log-rows 5000 --output results.json
+    python benchmarks/run_benchmarks.py --files 1000 --compare results.json
+
+Writes one JSON document with the parameters and per-operation timings.
+With --compare, exits 1 when an operation's median is slower than the
+baseline's by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import log_view  # noqa: E402
+import signing_log  # noqa: E402
+import synth_tree  # noqa: E402
+import thumbnails  # noqa: E402
+import timing  # noqa: E402
+from bench_signing import make_signature  # noqa: E402
+from qtg_core import QTGSet  # noqa: E402
+from qtg_signing import insertable_signature  # noqa: E402
+
+
+def measure(results, name, repeat, func, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    results.append({
+        "op": name,
+        "repeat": repeat,
+        "median_s": statistics.median(timings),
+        "p95_s": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_s": timings[0],
+    })
+
+
+def drop_log_caches(log_file):
+    signing_log._frame_cache.clear()
+    sidecar = signing_log._sidecar_path(log_file)
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+
+
+def use_cache_dir(root):
+    """Keep thumbnails, timing sinks and the search index under root.
+
+    The defaults are relative to the working directory, which would put
+    them in the caller's tree.  Workers spawned later read the environment.
+    """
+    cache_dir = os.path.join(root, ".qtg_cache")
+    os.environ["QTG_THUMB_DIR"] = thumbnails.CACHE_DIR = os.path.join(cache_dir, "thumbnails")
+    os.environ["QTG_TIMING_DIR"] = timing.SINK_DIR = os.path.join(cache_dir, "timing")
+    os.environ["QTG_SEARCH_DB"] = os.path.join(cache_dir, "search.sqlite3")
+
+
+def run(base_folder, repeat, signature_path):
+    results = []
+    qtg_set = QTGSet(base_folder)
+    index = qtg_set.index
+    # Freshly written folders fall inside the index's racy-mtime window and
+    # would be rescanned every time; age them like a real tree.
+    aged = time.time() - 60
+    for folder in index.folders.values():
+        os.utime(folder, (aged, aged))
+
+    measure(results, "listdir_source", repeat, lambda: os.listdir(qtg_set.source_folder))
+    measure(results, "index_reconcile_cold", repeat, index.reconcile,
+            setup=lambda: index.conn.execute("DELETE FROM folders"))
+    measure(results, "index_reconcile_warm", repeat, index.reconcile)
+    measure(results, "list_files", repeat, lambda: qtg_set.list_files(qtg_set.source_folder))
+    measure(results, "list_page_by_size", repeat,
+            lambda: index.page(qtg_set.source_folder, 0, 50, sort="size", descending=True, name_filter="1"))
+    measure(results, "list_page_metadata_cold", 1,
+            lambda: index.metadata(qtg_set.source_folder, index.page(qtg_set.source_folder, 0, 50)))
+
+    viewed, size, mtime_ns = index.entries(qtg_set.source_folder)[0]
+
+    def view_page():
+        thumbnails.page_image(viewed, size, mtime_ns, 0, thumbnails.PAGE_ZOOMS[-1], page_count=1)
+
+    def drop_page():
+        page_path = thumbnails._thumb_path(thumbnails.page_key(viewed, size, mtime_ns, 0, thumbnails.PAGE_ZOOMS[-1]))
+        if os.path.exists(page_path):
+            os.remove(page_path)
+
+    measure(results, "viewer_page_cold", repeat, view_page, setup=drop_page)
+    measure(results, "viewer_page_cached", repeat, view_page)
+
+    names = qtg_set.list_files(qtg_set.source_folder)
+    name = names[0]
+
+    def move_and_back():
+        qtg_set.move_file(os.path.join(qtg_set.source_folder, name), os.path.join(qtg_set.pass_folder, name))
+        qtg_set.move_file(os.path.join(qtg_set.pass_folder, name), os.path.join(qtg_set.source_folder, name))
+
+    measure(results, "move_file_roundtrip", repeat, move_and_back)
+
+    batch = names[1:51]
+
+    def retrieve_batch():
+        qtg_set.move_files(batch, qtg_set.source_folder, qtg_set.fail_folder)
+        qtg_set.retrieve_files(batch, qtg_set.fail_folder)
+
+    measure(results, f"retrieve_files_roundtrip_{len(batch)}", repeat, retrieve_batch)
+
+    measure(results, "log_load_cold", repeat, lambda: signing_log.read_log_frame(qtg_set.log_file),
+            setup=lambda: drop_log_caches(qtg_set.log_file))
+    measure(results, "log_load_sidecar", repeat, lambda: signing_log.read_log_frame(qtg_set.log_file),
+            setup=signing_log._frame_cache.clear)
+    measure(results, "log_load_warm", repeat, lambda: signing_log.read_log_frame(qtg_set.log_file))
+
+    def style_rowwise():
+        # How the CAE/EAT prototype coloured its tracker: a Python call per row
+        # of the whole log.
+        log_data = signing_log.load_log(qtg_set.log_file)
+        status = log_data.columns[signing_log.STATUS_COLUMN]
+        log_data.style.apply(
+            lambda row: [f"background-color: {log_view.STATUS_COLOURS.get(str(row[status]).strip(), '')}"] * len(row),
+            axis=1,
+        ).to_html()
+
+    def grid_page():
+        table = log_view.log_table(qtg_set.log_file)
+        matching = log_view.select(table, statuses=["Pass"], stages=[signing_log.FIRST_STAGE])
+        log_view.styled(log_view.page(matching, sort="Test Title", descending=True)).to_html()
+
+    measure(results, "log_grid_style_rowwise", 1, style_rowwise)
+    measure(results, "log_grid_build", repeat, lambda: log_view.log_table(qtg_set.log_file),
+            setup=log_view._tables.clear)
+    measure(results, "log_grid_filter_sort_page", repeat, grid_page)
+
+    measure(results, "update_excel_log_with_remarks", repeat,
+            lambda: qtg_set.update_excel_log_with_remarks(name.replace(".pdf", ""), "bench", "2024-01-01", "ok"))
+    measure(results, "log_materialize", 1, qtg_set.rebuild_log)
+
+    with open(signature_path, "rb") as f:
+        signature = insertable_signature(f.read())
+    to_sign = iter(qtg_set.list_files(qtg_set.pass_folder))
+    measure(results, "add_signature_and_update_log", min(repeat, len(qtg_set.list_files(qtg_set.pass_folder))),
+            lambda: qtg_set.add_signature_and_update_log(
+                os.path.join(qtg_set.pass_folder, next(to_sign)), signature, "bench", ""))
+
+    def scan_annotations():
+        # How the CAE/EAT prototype found signed stages: parse every page 0.
+        for path, _, _ in index.entries(qtg_set.signed_folder):
+            with fitz.open(path) as doc:
+                list(doc[0].annots())
+
+    measure(results, "signature_stage_scan_pdfs", repeat, scan_annotations)
+    measure(results, "signature_stage_query", repeat,
+            lambda: index.awaiting(qtg_set.signed_folder, "EAT", after="CAE"))
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {entry["op"]: entry for entry in json.load(f)["results"]}
+    regressions = []
+    for entry in results:
+        before = baseline.get(entry["op"])
+        if before and entry["median_s"] > before["median_s"] * (1 + tolerance):
+            regressions.append(f"{entry['op']}: {before['median_s']:.6f}s -> {entry['median_s']:.6f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    synth_tree.add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--dir", help="where to build the tree (defaults to a temporary directory)")
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--compare", help="baseline results to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        use_cache_dir(root)
+        options = synth_tree.tree_options(args)
+        options.update(devices=args.devices[:1], years=args.years[:1], sets=1)
+        base_folder = synth_tree.make_tree(root, **options)[0]
+        signature_path = os.path.join(root, "signature.jpg")
+        make_signature(signature_path)
+        results = run(base_folder, args.repeat, signature_path)
+
+    document = {
+        "params": vars(args),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
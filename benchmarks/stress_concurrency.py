@@ -0,0 +1,264 @@
+"""Run many concurrent reviewer sessions against one set and check nothing is lost.
+
+    python benchmarks/stress_concurrency.py --files 200 --processes 4 --threads 4 --seconds 20
+    python benchmarks/stress_concurrency.py --blob-store --interrupted 20
+
+Each process opens the set like a Streamlit server would and runs several
+threads that triage, retrieve, sign and rebuild the log at random.  Before
+they start, a process that is killed mid-move leaves --interrupted claims
+behind, half of them already linked into their destination; with
+--blob-store every file is also linked from the store.  --unlogged PDFs
+whose titles are missing from the log are added to the pass folder and
+signed once alone and once as a batch; that must fail and leave them
+only in the pass folder, still waiting for the first stage.  At the end
+every QTG must be in exactly one folder, no claim or lock files may be
+left behind, every signature a session reported must be in the log, and
+every file in the pass folder must still wait for the first stage.
+Prints throughput as JSON and exits 1 on any violation.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import blob_store  # noqa: E402
+import file_locks  # noqa: E402
+import qtg_signing  # noqa: E402
+import signing_log  # noqa: E402
+import synth_tree  # noqa: E402
+from bench_signing import make_signature  # noqa: E402
+from qtg_core import LogEntryNotFound, QTGError, QTGSet, log_name  # noqa: E402
+from qtg_signing import insertable_signature  # noqa: E402
+
+STATES = ["source", "pass", "fail"]
+# Half of all operations go to the first few names of a folder, so
+# sessions keep colliding on the same files.
+HOT_FILES = 5
+
+
+def visible_files(folder):
+    return [name for name in os.listdir(folder) if not name.startswith(".")]
+
+
+def session(qtg_set, signature, signer_name, deadline, seed, stats, signed, errors):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        op = rng.choices(["triage", "retrieve", "sign", "rebuild"], weights=[5, 4, 1, 1])[0]
+        start = time.perf_counter()
+        try:
+            if op == "rebuild":
+                qtg_set.rebuild_log()
+                outcome = "ok"
+            else:
+                src = {"triage": "source", "retrieve": rng.choice(["pass", "fail"]), "sign": "pass"}[op]
+                names = visible_files(qtg_set.folder(src))
+                if not names:
+                    continue
+                name = rng.choice(sorted(names)[:HOT_FILES] if rng.random() < 0.5 else names)
+                if op == "sign":
+                    try:
+                        qtg_set.add_signature_and_update_log(
+                            os.path.join(qtg_set.pass_folder, name), signature, signer_name, f"seed {seed}"
+                        )
+                        signed.append((log_name(name), signer_name))
+                        outcome = "ok"
+                    except QTGError:
+                        outcome = "conflict"
+                else:
+                    dest = rng.choice(["pass", "fail"]) if op == "triage" else "source"
+                    moved, failures = qtg_set.move_files([name], qtg_set.folder(src), qtg_set.folder(dest))
+                    outcome = "ok" if moved else "conflict"
+        except Exception as e:  # anything else is a bug the run should report
+            errors.append(f"{op}: {type(e).__name__}: {e}")
+            outcome = "error"
+        stats[(op, outcome)].append(time.perf_counter() - start)
+
+
+def interrupt_claims(base_folder, count):
+    """Die like a server killed mid-move, with claims taken from the pass folder.
+
+    Odd-numbered claims were already linked into the fail folder, so
+    recovery has to finish them; the rest have to be put back.
+    """
+    qtg_set = QTGSet(base_folder)
+    for number, name in enumerate(sorted(visible_files(qtg_set.pass_folder))[:count]):
+        dest = os.path.join(qtg_set.fail_folder, name)
+        claimed = file_locks.take(os.path.join(qtg_set.pass_folder, name), dest)
+        if number % 2:
+            os.link(claimed, dest)
+    os._exit(0)
+
+
+def sign_unlogged(base_folder, signature_path, count):
+    """Sign PDFs missing from the log and check none of them moved on."""
+    qtg_set = QTGSet(base_folder)
+    template = os.path.join(qtg_set.pass_folder, sorted(visible_files(qtg_set.pass_folder))[0])
+    paths = [os.path.join(qtg_set.pass_folder, f"UNLOGGED {number:03d}.pdf") for number in range(count)]
+    for path in paths:
+        shutil.copyfile(template, path)
+        qtg_set.index.added(path)
+    with open(signature_path, "rb") as f:
+        signature_bytes = f.read()
+    problems = []
+    try:
+        qtg_set.add_signature_and_update_log(paths[0], insertable_signature(signature_bytes), "unlogged", "")
+        problems.append(f"{log_name(paths[0])} was signed without a log entry")
+    except LogEntryNotFound:
+        pass
+    logged, failures = qtg_set.sign_files_in_batch(paths, signature_bytes, "unlogged", "", max_workers=2)
+    if logged or len(failures) != count:
+        problems.append(f"batch of unlogged PDFs: logged {logged}, {len(failures)} failures")
+    qtg_set.index.reconcile()
+    queued = set(qtg_set.stage_queue(qtg_signing.DEFAULT_STAGE))
+    for path in paths:
+        name = os.path.basename(path)
+        if not os.path.exists(path) or name not in queued:
+            problems.append(f"{name} left the {qtg_signing.DEFAULT_STAGE} queue after a failed signing")
+        for state in ("signed", "countersigned"):
+            if os.path.exists(os.path.join(qtg_set.folder(state), name)):
+                problems.append(f"{name} has a signed copy in {state} that was never logged")
+    return [log_name(path) for path in paths], problems
+
+
+def run_process(base_folder, signature_path, seconds, threads, process_number):
+    qtg_set = QTGSet(base_folder)
+    with open(signature_path, "rb") as f:
+        signature = insertable_signature(f.read())
+    stats, signed, errors = collections.defaultdict(list), [], []
+    deadline = time.monotonic() + seconds
+    workers = [
+        threading.Thread(
+            target=session,
+            args=(qtg_set, signature, f"reviewer-{process_number}-{number}", deadline,
+                  process_number * 1000 + number, stats, signed, errors),
+        )
+        for number in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return {f"{op}/{outcome}": timings for (op, outcome), timings in stats.items()}, signed, errors
+
+
+def verify(base_folder, titles, signed):
+    problems = []
+    qtg_set = QTGSet(base_folder)
+    qtg_set.rebuild_log()
+    seen = collections.Counter()
+    for state in STATES + ["signed", "countersigned"]:
+        folder = qtg_set.folder(state)
+        for name in os.listdir(folder):
+            if name.startswith("."):
+                if name != ".gitkeep":
+                    problems.append(f"left behind in {state}: {name}")
+                continue
+            seen[log_name(name)] += 1
+    for title in titles:
+        if seen[title] != 1:
+            problems.append(f"{title} is in {seen[title]} folders")
+    for name in os.listdir(base_folder):
+        if name.endswith(".lock"):
+            problems.append(f"lock file left behind: {name}")
+
+    log_data = signing_log.load_log(qtg_set.log_file)
+    columns = log_data.columns
+    signers = dict(zip(log_data[columns[signing_log.TITLE_COLUMN]], log_data[columns[signing_log.SIGNER_COLUMN]]))
+    for title, signer_name in signed:
+        if signers.get(title) != signer_name:
+            problems.append(f"lost update: {title} signed by {signer_name}, log says {signers.get(title)}")
+    if signing_log.pending_entries(qtg_set.log_file):
+        problems.append("journal entries left unapplied after rebuild")
+
+    qtg_set.rebuild_signatures()
+    queued = set(qtg_set.stage_queue(qtg_signing.DEFAULT_STAGE))
+    for name in visible_files(qtg_set.pass_folder):
+        if name not in queued:
+            problems.append(f"{name} is in the pass folder but not waiting for {qtg_signing.DEFAULT_STAGE}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    synth_tree.add_arguments(parser)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="sessions per process")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--interrupted", type=int, default=10, help="claims left behind by a killed process")
+    parser.add_argument("--blob-store", action="store_true", help="link every file from a blob store")
+    parser.add_argument("--unlogged", type=int, default=3, help="PDFs in the pass folder missing from the log")
+    parser.add_argument("--dir", help="where to build the tree (defaults to a temporary directory)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        options = synth_tree.tree_options(args)
+        options.update(devices=args.devices[:1], years=args.years[:1], sets=1, log_rows=args.files,
+                       pass_fraction=0.5)
+        base_folder = synth_tree.make_tree(root, **options)[0]
+        if args.blob_store:
+            # Spawned processes read the store from the environment.
+            os.environ["QTG_BLOB_STORE"] = blob_store.STORE_DIR = os.path.join(root, "store")
+            blob_store.dedupe(os.path.join(base_folder, f"{state}_folder") for state in STATES)
+        titles = [log_name(name) for state in STATES for name in visible_files(os.path.join(
+            base_folder, f"{state}_folder"))]
+        signature_path = os.path.join(root, "signature.jpg")
+        make_signature(signature_path)
+
+        unlogged_problems = []
+        if args.unlogged:
+            unlogged, unlogged_problems = sign_unlogged(base_folder, signature_path, args.unlogged)
+            titles += unlogged
+
+        context = multiprocessing.get_context("spawn")
+        if args.interrupted:
+            killed = context.Process(target=interrupt_claims, args=(base_folder, args.interrupted))
+            killed.start()
+            killed.join()
+
+        start = time.perf_counter()
+        with context.Pool(args.processes) as pool:
+            results = pool.starmap(
+                run_process,
+                [(base_folder, signature_path, args.seconds, args.threads, number) for number in range(args.processes)],
+            )
+        elapsed = time.perf_counter() - start
+
+        timings, signed, errors = collections.defaultdict(list), [], []
+        for process_timings, process_signed, process_errors in results:
+            for key, values in process_timings.items():
+                timings[key] += values
+            signed += process_signed
+            errors += process_errors
+        problems = unlogged_problems + errors + verify(base_folder, titles, signed)
+
+    total_ops = sum(len(values) for values in timings.values())
+    report = {
+        "sessions": args.processes * args.threads,
+        "interrupted": args.interrupted,
+        "blob_store": args.blob_store,
+        "unlogged": args.unlogged,
+        "seconds": round(elapsed, 2),
+        "ops_per_s": round(total_ops / elapsed, 1),
+        "ops": {
+            key: {"count": len(values), "median_ms": round(sorted(values)[len(values) // 2] * 1000, 2)}
+            for key, values in sorted(timings.items())
+        },
+        "signed": len(signed),
+        "problems": problems[:50],
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Generate synthetic FFS|FTD/<year>/<Set> trees for benchmarking.
+
+    python benchmarks/synth_tree.py /tmp/qtg-bench --files 1000 --pages 20 --pdf-kb 500 --log-rows 5000
+"""
+import argparse
+import os
+import shutil
+
+import fitz
+from openpyxl import Workbook
+
+LOG_HEADER = [
+    "Test No", "Test Title", "Auto / Manual", "Checked & Signed By ", "Run Date", "Verified By TCOPS",
+    "Check Date", "PASS /FAIL ", "Validated By ETIHAD", "Check Date", "Notes /Defect Reference",
+]
+FOLDERS = ["source_folder", "pass_folder", "fail_folder", "signed_folder"]
+
+
+def make_pdf(path, pages, size_kb):
+    """Write a PDF with the given page count and roughly the given size."""
+    doc = fitz.open()
+    per_page = max(0, size_kb * 1024 // max(pages, 1))
+    side = int((per_page / 3) ** 0.5)
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Synthetic QTG page {number + 1}", fontsize=14)
+        if side >= 8:
+            noise = fitz.Pixmap(fitz.csRGB, side, side, os.urandom(side * side * 3), False)
+            page.insert_image(fitz.Rect(72, 100, 472, 500), pixmap=noise)
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def make_log(path, titles, extra_rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(LOG_HEADER)
+    for number, title in enumerate(titles, start=1):
+        sheet.append([f"4.{number}", title] + [None] * (len(LOG_HEADER) - 2))
+    for number in range(extra_rows):
+        sheet.append([f"9.{number}", f"archived-{number}", "Auto", "someone", "2023-01-01", None, None,
+                      "FAIL" if number % 10 == 0 else "PASS", f"signer-{number % 7}", "2023-01-02", None])
+    workbook.save(path)
+
+
+def make_tree(root, devices=("FFS", "FTD"), years=("2024",), sets=1, files=100, pages=5, pdf_kb=100,
+              log_rows=1000, pass_fraction=0.25):
+    """Create the tree and return the list of set folders."""
+    template = os.path.join(root, ".template.pdf")
+    os.makedirs(root, exist_ok=True)
+    make_pdf(template, pages, pdf_kb)
+    set_folders = []
+    for device in devices:
+        for year in years:
+            for set_number in range(sets):
+                base_folder = os.path.join(root, device, year, f"Set {chr(ord('A') + set_number)}")
+                for folder in FOLDERS:
+                    os.makedirs(os.path.join(base_folder, folder), exist_ok=True)
+                titles = [f"QTG {number:05d}" for number in range(files)]
+                passed = int(files * pass_fraction)
+                for number, title in enumerate(titles):
+                    folder = "pass_folder" if number < passed else "source_folder"
+                    shutil.copyfile(template, os.path.join(base_folder, folder, title + ".pdf"))
+                make_log(os.path.join(base_folder, "signing_log.xlsx"), titles, max(0, log_rows - files))
+                set_folders.append(base_folder)
+    os.remove(template)
+    return set_folders
+
+
+def add_arguments(parser):
+    parser.add_argument("--devices", nargs="+", default=["FFS", "FTD"])
+    parser.add_argument("--years", nargs="+", default=["2024"])
+    parser.add_argument("--sets", type=int, default=1, help="sets per device and year")
+    parser.add_argument("--files", type=int, default=100, help="QTGs per set")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--pdf-kb", type=int, default=100)
+    parser.add_argument("--log-rows", type=int, default=1000)
+
+
+def tree_options(args):
+    return dict(devices=args.devices, years=args.years, sets=args.sets, files=args.files, pages=args.pages,
+                pdf_kb=args.pdf_kb, log_rows=args.log_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root")
+    add_arguments(parser)
+    args = parser.parse_args()
+    for base_folder in make_tree(args.root, **tree_options(args)):
+        print(base_folder)
+
+
+if __name__ == "__main__":
+    main()
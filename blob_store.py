@@ -0,0 +1,193 @@
+import errno
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+import threading
+
+# Optional content-addressed storage.  With QTG_BLOB_STORE set to a
+# directory on the same filesystem as the device trees, each PDF is kept
+# once under blobs/<ab>/<sha256> and set folders hold hard links to it, so
+# a blob's reference count is simply its link count.  Blobs are read-only:
+# the workflow never edits a PDF in place (signing writes a new file).
+STORE_DIR = os.environ.get("QTG_BLOB_STORE", "")
+INDEX_FILE = "blobs.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS blobs_inode ON blobs (dev, ino);
+"""
+
+# Errors from os.link() that mean the filesystem cannot link these two
+# paths at all; callers fall back to keeping a plain copy.
+NO_LINK_ERRNOS = (errno.EPERM, errno.ENOTSUP, errno.EXDEV)
+
+_lock = threading.Lock()
+_conn = None
+
+
+def enabled():
+    return bool(STORE_DIR)
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        _conn = sqlite3.connect(os.path.join(STORE_DIR, INDEX_FILE), check_same_thread=False, isolation_level=None)
+        _conn.executescript(SCHEMA)
+    return _conn
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(sha256):
+    return os.path.join(STORE_DIR, "blobs", sha256[:2], sha256)
+
+
+def _record(sha256, path):
+    st = os.stat(path)
+    with _lock:
+        _db().execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)", (sha256, st.st_dev, st.st_ino, st.st_size))
+
+
+def _freeze(path):
+    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def content_hash(path):
+    """The SHA-256 of a file that is linked to a blob, else None; never reads the file."""
+    if not enabled():
+        return None
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if st.st_nlink < 2:
+        return None
+    with _lock:
+        row = _db().execute("SELECT sha256 FROM blobs WHERE dev = ? AND ino = ?", (st.st_dev, st.st_ino)).fetchone()
+    return row[0] if row else None
+
+
+def _ensure_blob(path, sha256, adopt):
+    """Make sure the blob for sha256 exists; adopt links path itself in."""
+    target = blob_path(sha256)
+    if os.path.exists(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if adopt:
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            return target
+        _freeze(target)
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            _freeze(tmp_path)
+            os.link(tmp_path, target)  # fails instead of replacing a concurrent writer's blob
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    _record(sha256, target)
+    return target
+
+
+def store_copy(src, dest):
+    """Copy src to dest through the store; dest ends up a link to the blob.
+
+    Raises FileExistsError if dest exists.  Falls back to a plain copy
+    where hard links are not possible.
+    """
+    sha256 = file_hash(src)
+    target = _ensure_blob(src, sha256, adopt=False)
+    try:
+        try:
+            os.link(target, dest)
+        except FileNotFoundError:  # collected by gc() in between
+            os.link(_ensure_blob(src, sha256, adopt=False), dest)
+    except OSError as e:
+        if isinstance(e, FileExistsError) or e.errno not in NO_LINK_ERRNOS:
+            raise
+        if os.path.exists(dest):
+            raise FileExistsError(errno.EEXIST, "File exists", dest) from None
+        shutil.copy2(src, dest)
+    return sha256
+
+
+def adopt(path):
+    """Replace path by a link to its blob, creating the blob from it if new.
+
+    Returns (sha256, bytes saved).  Where hard links are not possible path
+    is left as it is, un-deduplicated, and nothing is saved.
+    """
+    existing = content_hash(path)
+    if existing:
+        return existing, 0
+    sha256 = file_hash(path)
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.dedupe")
+    try:
+        target = _ensure_blob(path, sha256, adopt=True)
+        if os.path.samefile(target, path):
+            return sha256, 0
+        # Swap in the link atomically so path never goes missing.
+        os.link(target, tmp_path)
+    except OSError as e:
+        if isinstance(e, FileExistsError) or e.errno not in NO_LINK_ERRNOS:
+            raise
+        return sha256, 0
+    size = os.stat(path).st_size
+    os.replace(tmp_path, path)
+    return sha256, size
+
+
+def dedupe(folders):
+    """Adopt every PDF in folders; return (files, bytes saved)."""
+    files = saved = 0
+    for folder in folders:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                saved += adopt(entry.path)[1]
+                files += 1
+    return files, saved
+
+
+def gc():
+    """Delete blobs no folder links to any more; return (blobs, bytes) freed."""
+    freed = freed_bytes = 0
+    with _lock:
+        rows = _db().execute("SELECT sha256 FROM blobs").fetchall()
+    for (sha256,) in rows:
+        target = blob_path(sha256)
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            st = None
+        if st is not None and st.st_nlink > 1:
+            continue
+        if st is not None:
+            os.remove(target)
+            freed += 1
+            freed_bytes += st.st_size
+        with _lock:
+            _db().execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+    return freed, freed_bytes
@@ -0,0 +1,141 @@
+import functools
+import hashlib
+import io
+import os
+import threading
+
+import lazy_import
+
+if lazy_import.installed("pyhanko"):
+    serialization = lazy_import.module("cryptography.hazmat.primitives.serialization")
+    padding = lazy_import.module("cryptography.hazmat.primitives.asymmetric.padding")
+    incremental_writer = lazy_import.module("pyhanko.pdf_utils.incremental_writer")
+    fields = lazy_import.module("pyhanko.sign.fields")
+    general = lazy_import.module("pyhanko.sign.general")
+    signers = lazy_import.module("pyhanko.sign.signers")
+    stamp = lazy_import.module("pyhanko.stamp")
+    images = lazy_import.module("pyhanko.pdf_utils.images")
+    layout = lazy_import.module("pyhanko.pdf_utils.layout")
+    Image = lazy_import.module("PIL.Image")
+else:
+    signers = None
+
+# Each certificate signature gets its own field, so a document signed by
+# several reviewers keeps every earlier signature valid.
+FIELD_PREFIX = "QTGSignature"
+# Room left for the CMS container on top of the certificates it embeds.
+# pyHanko otherwise sizes it with a throwaway signature per document.
+RESERVED_BYTES = 8192
+
+_lock = threading.Lock()
+_loaded = {}  # (path, mtime_ns, passphrase digest) -> ReusedKeySigner
+
+
+class CertificateError(ValueError):
+    pass
+
+
+@functools.cache
+def _reused_key_signer():
+    # Subclassing SimpleSigner imports pyHanko, so wait until a signer is needed.
+    class ReusedKeySigner(signers.SimpleSigner):
+        """A SimpleSigner that parses its private key once.
+
+        SimpleSigner decodes and validates the key for every signature,
+        which costs more than the RSA operation itself.
+        """
+
+        def __init__(self, loaded):
+            super().__init__(
+                signing_cert=loaded.signing_cert, signing_key=loaded.signing_key, cert_registry=loaded.cert_registry
+            )
+            self._private_key = serialization.load_der_private_key(self.signing_key.dump(), password=None)
+            self.bytes_reserved = RESERVED_BYTES + sum(
+                len(cert.dump()) for cert in [self.signing_cert, *self.cert_registry]
+            )
+
+        def sign_raw(self, data, digest_algorithm):
+            mechanism = self.get_signature_mechanism_for_digest(digest_algorithm).signature_algo
+            if mechanism != "rsassa_pkcs1v15":
+                return super().sign_raw(data, digest_algorithm)
+            return self._private_key.sign(
+                data, padding.PKCS1v15(), general.get_pyca_cryptography_hash(digest_algorithm)
+            )
+
+    return ReusedKeySigner
+
+
+def available():
+    return signers is not None
+
+
+def load_signer(pkcs12_path, passphrase):
+    """Open a PKCS#12 key and certificate; later calls reuse the loaded key."""
+    if signers is None:
+        raise CertificateError("Certificate signing needs pyHanko (pip install pyHanko).")
+    if not pkcs12_path or not os.path.exists(pkcs12_path):
+        raise CertificateError("No certificate saved for this signer.")
+    key = (pkcs12_path, os.stat(pkcs12_path).st_mtime_ns, hashlib.sha256(passphrase.encode("utf-8")).hexdigest())
+    with _lock:
+        signer = _loaded.get(key)
+        if signer is None:
+            loaded = signers.SimpleSigner.load_pkcs12(pkcs12_path, passphrase=passphrase.encode("utf-8") or None)
+            if loaded is None:
+                raise CertificateError("Could not open the certificate; check the passphrase.")
+            signer = _loaded[key] = _reused_key_signer()(loaded)
+    return signer
+
+
+def subject(signer):
+    return signer.signing_cert.subject.human_friendly
+
+
+def _stamp_style(image_bytes, text):
+    # The image fills the top of the box and the text sits underneath,
+    # like a stamp drawn on the page.
+    return stamp.TextStampStyle(
+        stamp_text=text.replace("%", "%%"),
+        background=images.PdfImage(Image.open(io.BytesIO(image_bytes))),
+        background_opacity=1,
+        background_layout=layout.SimpleBoxLayoutRule(
+            x_align=layout.AxisAlignment.ALIGN_MIN, y_align=layout.AxisAlignment.ALIGN_MAX,
+            margins=layout.Margins(bottom=30), inner_content_scaling=layout.InnerScaling.SHRINK_TO_FIT,
+        ),
+        inner_content_layout=layout.SimpleBoxLayoutRule(
+            x_align=layout.AxisAlignment.ALIGN_MIN, y_align=layout.AxisAlignment.ALIGN_MIN,
+        ),
+        text_box_style=stamp.TextBoxStyle(font_size=10),
+        border_width=0,
+    )
+
+
+def certify(pdf_path, signer, reason=None, appearance=None):
+    """Add a PAdES signature to a PDF in place, as an incremental update.
+
+    The signature is invisible unless appearance, an (image bytes, box,
+    text) triple with box in PDF user space on page 0, is given; then its
+    widget shows the image above the text.
+    """
+    partial_path = f"{pdf_path}.pades"
+    try:
+        with open(pdf_path, "rb") as f:
+            writer = incremental_writer.IncrementalPdfFileWriter(f, strict=False)
+            existing = sum(1 for _ in fields.enumerate_sig_fields(writer))
+            metadata = signers.PdfSignatureMetadata(
+                field_name=f"{FIELD_PREFIX}{existing + 1}",
+                subfilter=fields.SigSeedSubFilter.PADES,
+                md_algorithm="sha256",
+                reason=reason,
+            )
+            new_field, style = None, None
+            if appearance is not None:
+                image_bytes, box, text = appearance
+                new_field = fields.SigFieldSpec(metadata.field_name, on_page=0, box=box)
+                style = _stamp_style(image_bytes, text)
+            pdf_signer = signers.PdfSigner(metadata, signer=signer, new_field_spec=new_field, stamp_style=style)
+            with open(partial_path, "wb") as out:
+                pdf_signer.sign_pdf(writer, output=out, bytes_reserved=getattr(signer, "bytes_reserved", None))
+        os.replace(partial_path, pdf_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
@@ -0,0 +1,285 @@
+import errno
+import json
+import os
+import random
+import shutil
+import socket
+import time
+import uuid
+
+# A lock whose holder cannot be checked (another host) is taken over once
+# it is this old; same-host locks are recovered as soon as the holder exits.
+STALE_AFTER_S = float(os.environ.get("QTG_LOCK_STALE_S", "300"))
+CLAIM_PREFIX = ".claim-"
+OWNER_PREFIX = ".owner-"
+
+_HOST = socket.gethostname()
+
+
+class LockBusy(TimeoutError):
+    def __init__(self, path):
+        super().__init__(f"'{os.path.basename(path)}' is locked by another reviewer; try again shortly.")
+        self.path = path
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # e.g. EPERM: alive, but owned by another user
+    return True
+
+
+def _is_stale(path, stale_after):
+    try:
+        with open(path) as f:
+            holder = json.load(f)
+        age = time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError):
+        # A half-written lock file: give its writer a moment to finish.
+        try:
+            return time.time() - os.stat(path).st_mtime > 1
+        except FileNotFoundError:
+            return False
+    return holder_gone(holder.get("host"), holder.get("pid", 0), age, stale_after)
+
+
+def holder_gone(host, pid, age, stale_after=STALE_AFTER_S):
+    """Whether whoever recorded host and pid age seconds ago has gone away.
+
+    A holder on this host is gone once its process has exited; one on
+    another host cannot be checked, so it is presumed gone when stale.
+    """
+    if host == _HOST:
+        return not _pid_alive(pid or 0)
+    return age > stale_after
+
+
+def _break(path):
+    """Remove a stale lock; of several processes doing this only one succeeds."""
+    tombstone = f"{path}.stale-{uuid.uuid4().hex}"
+    try:
+        os.rename(path, tombstone)
+    except FileNotFoundError:
+        return
+    os.remove(tombstone)
+
+
+class LockFile:
+    """An exclusive lock held by creating a file with O_EXCL.
+
+    Works across processes and on network shares where flock() does not.
+    Locks left behind by a crashed holder are detected and taken over.
+
+        with LockFile(path + ".lock", timeout=10):
+            ...
+    """
+
+    def __init__(self, path, timeout=30.0, stale_after=STALE_AFTER_S):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        delay = 0.005
+        body = json.dumps({"host": _HOST, "pid": os.getpid(), "token": self.token, "at": time.time()})
+        while True:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if _is_stale(self.path, self.stale_after):
+                    _break(self.path)
+                    continue
+                if time.monotonic() >= deadline:
+                    raise LockBusy(self.path)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, 0.25)
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(body)
+            return self
+
+    def release(self):
+        try:
+            with open(self.path) as f:
+                mine = json.load(f).get("token") == self.token
+        except (FileNotFoundError, ValueError):
+            return
+        if mine:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def lock_path(path):
+    """The hidden lock file guarding a file, next to it."""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.lock")
+
+
+def _owner_path(claimed):
+    """The file recording who holds a claim, next to it."""
+    folder, name = os.path.split(claimed)
+    token = name[len(CLAIM_PREFIX):len(CLAIM_PREFIX) + 32]
+    return os.path.join(folder, f"{OWNER_PREFIX}{token}")
+
+
+def _holder(claimed):
+    try:
+        with open(_owner_path(claimed)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def take(path, dest=None):
+    """Rename path to a private claim name in its folder and return that name.
+
+    Only one caller can take a file; the others get FileNotFoundError.  The
+    host and pid taking it, and dest if it is headed somewhere, are written
+    to an owner file first, so a claim left behind by a process that died
+    can be told from one still in use and finished or put back.
+    """
+    folder, name = os.path.split(path)
+    token = uuid.uuid4().hex
+    owner = os.path.join(folder, f"{OWNER_PREFIX}{token}")
+    with open(owner, "x") as f:
+        json.dump({"host": _HOST, "pid": os.getpid(), "at": time.time(), "dest": dest}, f)
+    claimed = os.path.join(folder, f"{CLAIM_PREFIX}{token}-{name}")
+    try:
+        os.rename(path, claimed)
+    except BaseException:
+        os.remove(owner)
+        raise
+    return claimed
+
+
+def _release(claimed):
+    try:
+        os.remove(_owner_path(claimed))
+    except FileNotFoundError:
+        pass
+
+
+def put_back(claimed, path):
+    """Return a taken file to its original name.
+
+    Returns False if the claim is gone because it was already recovered.
+    """
+    try:
+        os.rename(claimed, path)
+    except FileNotFoundError:
+        return False
+    _release(claimed)
+    return True
+
+
+def finish(claimed):
+    """Drop a claim whose file has been copied or linked to where it belongs."""
+    try:
+        os.remove(claimed)
+    except FileNotFoundError:
+        pass
+    _release(claimed)
+
+
+def claim(src, dest):
+    """Move src to dest unless dest exists; safe against concurrent movers.
+
+    src is first renamed to a private claim name, so of several reviewers
+    moving the same file only one gets it.  It is then hard-linked to dest,
+    which fails instead of overwriting, and finally unlinked.  Raises
+    FileNotFoundError if someone else moved src first and FileExistsError if
+    dest is taken; in both cases nothing is changed.
+    """
+    claimed = take(src, dest)
+    try:
+        os.link(claimed, dest)
+    except OSError as e:
+        try:
+            if isinstance(e, FileExistsError) or e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+                raise
+            # No hard links here (or another filesystem): fall back to a
+            # checked move, which only races with a writer of dest itself.
+            if os.path.exists(dest):
+                raise FileExistsError(errno.EEXIST, "File exists", dest) from None
+            shutil.move(claimed, dest)
+        except BaseException:
+            if not put_back(claimed, src):
+                _release(claimed)
+            raise
+        _release(claimed)
+        return
+    finish(claimed)
+
+
+def _claim_stale(claimed, stale_after):
+    owner = _owner_path(claimed)
+    if os.path.exists(owner):
+        return _is_stale(owner, stale_after)
+    # No owner recorded (a claim from an older version): judge by age alone.
+    # rename() updates ctime, not mtime, so ctime is when the claim began.
+    try:
+        return time.time() - os.stat(claimed).st_ctime > stale_after
+    except FileNotFoundError:
+        return False
+
+
+def recover_claim(claimed, stale_after=STALE_AFTER_S):
+    """Put back one claimed file if its holder is gone; return its name if restored.
+
+    A claim that already reached its recorded destination is finished
+    instead.  That is decided by comparing inodes: the link count says
+    nothing when files are also linked from the blob store.
+    """
+    if not _claim_stale(claimed, stale_after):
+        return None
+    dest = (_holder(claimed) or {}).get("dest")
+    try:
+        st = os.stat(claimed)
+        linked = dest is not None and os.path.samestat(st, os.stat(dest))
+    except FileNotFoundError:
+        linked = False
+    if linked:
+        finish(claimed)
+        return None
+    folder, claim_name = os.path.split(claimed)
+    name = claim_name[len(CLAIM_PREFIX) + 33:]
+    original = os.path.join(folder, name)
+    if os.path.exists(original) or not put_back(claimed, original):
+        return None
+    return name
+
+
+def recover_claims(folder, stale_after=STALE_AFTER_S):
+    """Put back files whose claim was interrupted; return their names.
+
+    Also removes owner files left by a take() that died before its rename.
+    """
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    recovered = []
+    tokens = set()
+    for name in names:
+        if name.startswith(CLAIM_PREFIX):
+            tokens.add(name[len(CLAIM_PREFIX):len(CLAIM_PREFIX) + 32])
+            restored = recover_claim(os.path.join(folder, name), stale_after)
+            if restored is not None:
+                recovered.append(restored)
+    for name in names:
+        owner = os.path.join(folder, name)
+        if name.startswith(OWNER_PREFIX) and name[len(OWNER_PREFIX):] not in tokens and _is_stale(owner, stale_after):
+            _break(owner)
+    return recovered
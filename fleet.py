@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+
+import lazy_import
+import signing_log
+import timing
+from qtg_core import LOG_FILE, discover_sets
+from qtg_index import FOLDER_NAMES, QTGIndex
+
+pd = lazy_import.module("pandas")
+
+STATS_FILE = os.environ.get("QTG_FLEET_DB", os.path.join(".qtg_cache", "fleet.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sets (
+    base_folder TEXT PRIMARY KEY,
+    device TEXT,
+    year TEXT,
+    set_name TEXT,
+    log_version TEXT,
+    journal_offset INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS state_counts (
+    base_folder TEXT NOT NULL,
+    state TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (base_folder, state)
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    base_folder TEXT NOT NULL,
+    title TEXT NOT NULL,
+    signer TEXT,
+    day TEXT,
+    PRIMARY KEY (base_folder, title)
+);
+"""
+
+
+def _day(value):
+    if value is None or pd.isna(value) or value == "":
+        return None
+    return str(value)[:10]
+
+
+class FleetStats:
+    """Per-set counts by state, signer and day for every set under a root.
+
+    A refresh costs one stat() per folder and one of the xlsx and journal
+    per set.  Folder counts come from each set's QTGIndex, which rescans
+    only folders whose mtime changed.  Signatures are folded in from the
+    journal tail since the last refresh; the log itself is re-read only
+    when the xlsx was replaced.
+    """
+
+    def __init__(self, root=".", db_path=STATS_FILE):
+        self.root = root
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+
+    def _index(self, base_folder):
+        if base_folder not in self._indexes:
+            self._indexes[base_folder] = QTGIndex(base_folder)
+        return self._indexes[base_folder]
+
+    def refresh(self):
+        with self._lock, timing.span("fleet.refresh"):
+            known = {row[0]: row[1:] for row in self.conn.execute(
+                "SELECT base_folder, log_version, journal_offset FROM sets"
+            )}
+            seen = set()
+            for device, year, set_name, base_folder in discover_sets(self.root):
+                seen.add(base_folder)
+                log_version, journal_offset = known.get(base_folder, (None, 0))
+                self._refresh_set(device, year, set_name, base_folder, log_version, journal_offset)
+            for base_folder in known.keys() - seen:
+                self._write([
+                    (f"DELETE FROM {table} WHERE base_folder = ?", [(base_folder,)])
+                    for table in ("sets", "state_counts", "signatures")
+                ])
+
+    def _refresh_set(self, device, year, set_name, base_folder, log_version, journal_offset):
+        index = self._index(base_folder)
+        index.reconcile()
+        counts = index.counts()
+        statements = [(
+            "INSERT OR REPLACE INTO state_counts VALUES (?, ?, ?)",
+            [(base_folder, state, counts.get(state, 0)) for state in FOLDER_NAMES],
+        )]
+
+        log_file = os.path.join(base_folder, LOG_FILE)
+        try:
+            st = os.stat(log_file)
+            version = f"{st.st_mtime_ns}:{st.st_size}"
+        except FileNotFoundError:
+            version = None
+        if version != log_version:
+            # The xlsx was replaced (rebuilt or edited): start over from it.
+            journal_offset = signing_log.applied_offset(log_file) if version else 0
+            statements.append(("DELETE FROM signatures WHERE base_folder = ?", [(base_folder,)]))
+            if version:
+                log_data = signing_log.read_log_frame(log_file)
+                columns = log_data.columns
+                statements.append((
+                    "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?)",
+                    [
+                        (base_folder, str(title), str(signer), _day(signed_on))
+                        for title, signer, signed_on in log_data[[
+                            columns[signing_log.TITLE_COLUMN],
+                            columns[signing_log.SIGNER_COLUMN],
+                            columns[signing_log.DATE_COLUMN],
+                        ]].itertuples(index=False)
+                        if not pd.isna(signer) and str(signer).strip()
+                    ],
+                ))
+        records, journal_offset = signing_log.read_journal(log_file, journal_offset)
+        statements.append((
+            "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?)",
+            [
+                (base_folder, record["file_name"], record["signer_name"], _day(record["signing_date"]))
+                for record in records
+                if signing_log.record_stage(record) == signing_log.FIRST_STAGE
+            ],
+        ))
+        statements.append((
+            "INSERT OR REPLACE INTO sets VALUES (?, ?, ?, ?, ?, ?)",
+            [(base_folder, device, year, set_name, version, journal_offset)],
+        ))
+        self._write(statements)
+
+    def _write(self, statements):
+        self.conn.execute("BEGIN")
+        try:
+            for sql, rows in statements:
+                self.conn.executemany(sql, rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def state_table(self):
+        """One row per set with a column per folder state."""
+        with self._lock:
+            frame = pd.read_sql_query(
+                "SELECT s.device, s.year, s.set_name, c.state, c.count "
+                "FROM sets s JOIN state_counts c USING (base_folder)",
+                self.conn,
+            )
+        states = list(FOLDER_NAMES)
+        if frame.empty:
+            return pd.DataFrame(columns=["device", "year", "set_name", *states])
+        table = frame.pivot_table(
+            index=["device", "year", "set_name"], columns="state", values="count", aggfunc="sum", fill_value=0
+        )
+        return table.reindex(columns=states, fill_value=0).reset_index().rename_axis(columns=None)
+
+    def signer_table(self):
+        """Signatures per signer and set."""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT signer, s.device, s.year, s.set_name, COUNT(*) AS signed "
+                "FROM signatures JOIN sets s USING (base_folder) "
+                "GROUP BY signer, base_folder ORDER BY signed DESC",
+                self.conn,
+            )
+
+    def daily_table(self):
+        """Signatures per day across the fleet."""
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT day, COUNT(*) AS signed FROM signatures WHERE day IS NOT NULL GROUP BY day ORDER BY day",
+                self.conn,
+            )
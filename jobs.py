@@ -0,0 +1,281 @@
+import collections
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cert_signing
+import file_locks
+import qtg_signing
+import signer_profiles
+import timing
+from qtg_core import QTGError, QTGSet, log_name
+
+JOBS_FILE = os.environ.get("QTG_JOBS_DB", os.path.join(".qtg_cache", "jobs.sqlite3"))
+MAX_WORKERS = 2
+ACTIVE = ("queued", "running")
+# Each server refreshes the heartbeat of the jobs it owns this often.  A
+# job whose owner on this host has exited is taken over at once; one owned
+# from another host once its heartbeat is JOB_STALE_S old.
+HEARTBEAT_S = 10
+JOB_STALE_S = float(os.environ.get("QTG_JOB_STALE_S", "60"))
+
+_HOST = socket.gethostname()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    base_folder TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    host TEXT,
+    pid INTEGER,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+# Added after the first release; older job files get them on open.
+OWNER_COLUMNS = (("owner", "TEXT"), ("host", "TEXT"), ("pid", "INTEGER"), ("heartbeat", "REAL"))
+
+Job = collections.namedtuple(
+    "Job", "id kind base_folder params status done total result error created updated owner host pid heartbeat"
+)
+
+
+def _split_done(names, folder, done_folder):
+    """Split names into those still to process and those an earlier attempt finished."""
+    pending, finished, missing = [], [], []
+    for name in names:
+        if os.path.exists(os.path.join(folder, name)):
+            pending.append(name)
+        elif os.path.exists(os.path.join(done_folder, name)):
+            finished.append(name)
+        else:
+            missing.append((name, "file not found"))
+    return pending, finished, missing
+
+
+def run_move(qtg_set, params, progress):
+    """Move names between two folder states of the set."""
+    src_folder, dest_folder = qtg_set.folder(params["src"]), qtg_set.folder(params["dest"])
+    pending, finished, failures = _split_done(params["names"], src_folder, dest_folder)
+    moved, failed = qtg_set.move_files(pending, src_folder, dest_folder)
+    progress(len(params["names"]), len(params["names"]))
+    return {"done": finished + moved, "failures": failures + [(name, str(e)) for name, e in failed]}
+
+
+def run_sign(qtg_set, params, progress):
+    """Sign names for a review stage with a saved signer profile.
+
+    With certify set, documents also get a PAdES signature from the signer's
+    saved certificate; the passphrase comes from the job's secrets.
+    """
+    signer_name, remarks = params["signer_name"], params["remarks"]
+    stage = params.get("stage", qtg_signing.DEFAULT_STAGE)
+    src_folder, dest_folder = qtg_set.stage_folders(stage)
+    certificate = None
+    if params.get("certify"):
+        if "passphrase" not in params:
+            raise QTGError("The certificate passphrase is not kept across restarts; sign the documents again.")
+        certificate = (signer_profiles.certificate_path(signer_name), params["passphrase"])
+    pending, finished, failures = _split_done(params["names"], src_folder, dest_folder)
+    paths = [os.path.join(src_folder, name) for name in pending]
+    if len(paths) == 1:
+        try:
+            qtg_set.add_signature_and_update_log(
+                paths[0], signer_profiles.signature_stamp(signer_name), signer_name, remarks,
+                signer=cert_signing.load_signer(*certificate) if certificate else None, stage=stage,
+            )
+            finished += pending
+        except QTGError as e:
+            failures.append((pending[0], str(e)))
+        progress(1, 1)
+    elif paths:
+        logged, failed = qtg_set.sign_files_in_batch(
+            paths, signer_profiles.signature_bytes(signer_name), signer_name, remarks, progress=progress,
+            certificate=certificate, stage=stage,
+        )
+        logged = set(logged)
+        finished += [name for name in pending if log_name(name) in logged]
+        failures += [(name, str(e)) for name, e in failed]
+    return {
+        "done": finished,
+        "failures": failures,
+        "signed": [os.path.join(dest_folder, name) for name in finished],
+    }
+
+
+HANDLERS = {"move": run_move, "sign": run_sign}
+
+
+class JobQueue:
+    """Durable background jobs for one app process.
+
+    Every job is a row in a SQLite file before it is queued, and handlers
+    skip work an earlier attempt already finished, so jobs that were queued
+    or running when their server died are simply run again.  Rows record
+    which queue owns them and carry its heartbeat, so a server only resumes
+    jobs whose owner is gone, never those of another live server.
+    Jobs on the same set run one at a time.  Secrets such as a certificate
+    passphrase are handed to the job in memory only; a job resumed after a
+    restart runs without them.
+    """
+
+    def __init__(self, db_path=JOBS_FILE, max_workers=MAX_WORKERS):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._sets = {}
+        self._set_locks = collections.defaultdict(threading.Lock)
+        self._secrets = {}
+        self.owner = uuid.uuid4().hex
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in OWNER_COLUMNS:
+            if column not in columns:
+                try:
+                    self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # another server added it first
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="qtg-job")
+        self.adopt_orphans()
+        threading.Thread(target=self._beat, name="qtg-job-heartbeat", daemon=True).start()
+
+    def _orphaned(self, owner, host, pid, heartbeat):
+        if owner == self.owner:
+            return False
+        if host == _HOST and pid == os.getpid():
+            return True  # an earlier queue in a process that reused our pid
+        return file_locks.holder_gone(host, pid, time.time() - (heartbeat or 0), JOB_STALE_S)
+
+    def adopt_orphans(self):
+        """Take over and run the active jobs whose server has gone; return their ids.
+
+        Jobs still owned by a live server, here or on another host, are
+        left to it.  Taking one over is a compare-and-set on its owner, so
+        of several servers starting together only one resumes each job.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, owner, host, pid, heartbeat FROM jobs WHERE status IN (?, ?) ORDER BY created", ACTIVE
+            ).fetchall()
+        adopted = []
+        for job_id, owner, host, pid, heartbeat in rows:
+            if not self._orphaned(owner, host, pid, heartbeat):
+                continue
+            with self._lock:
+                taken = self.conn.execute(
+                    "UPDATE jobs SET owner = ?, host = ?, pid = ?, heartbeat = ? WHERE id = ? AND owner IS ?",
+                    (self.owner, _HOST, os.getpid(), time.time(), job_id, owner),
+                ).rowcount
+            if taken:
+                adopted.append(job_id)
+                self._executor.submit(self._run, job_id)
+        return adopted
+
+    def _beat(self):
+        while True:
+            time.sleep(HEARTBEAT_S)
+            try:
+                with self._lock:
+                    self.conn.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                        (time.time(), self.owner, *ACTIVE),
+                    )
+                self.adopt_orphans()
+            except sqlite3.Error:
+                pass  # e.g. the job file is busy; try again on the next beat
+
+    def register(self, qtg_set):
+        """Run this set's jobs on an already open QTGSet, sharing its index."""
+        with self._lock:
+            self._sets[qtg_set.base_folder] = qtg_set
+
+    def _open(self, base_folder):
+        with self._lock:
+            if base_folder not in self._sets:
+                self._sets[base_folder] = QTGSet(base_folder)
+            return self._sets[base_folder]
+
+    def submit(self, kind, base_folder, secrets=None, **params):
+        """Record a job and queue it; return its id.
+
+        secrets are merged into params for the handler but never written.
+        """
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}'.")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, base_folder, params, status, total, created, updated, "
+                "owner, host, pid, heartbeat) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, base_folder, json.dumps(params), len(params.get("names", ())), now, now,
+                 self.owner, _HOST, os.getpid(), now),
+            )
+            if secrets:
+                self._secrets[job_id] = secrets
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(*row)
+        return job._replace(params=json.loads(job.params), result=job.result and json.loads(job.result))
+
+    def active(self, base_folder=None):
+        """Ids of the queued and running jobs, optionally for one set."""
+        sql = "SELECT id FROM jobs WHERE status IN (?, ?)"
+        params = ACTIVE
+        if base_folder is not None:
+            sql += " AND base_folder = ?"
+            params += (base_folder,)
+        with self._lock:
+            return [job_id for (job_id,) in self.conn.execute(sql + " ORDER BY created", params)]
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        with self._lock:
+            secrets = self._secrets.pop(job_id, {})
+        with self._set_locks[job.base_folder]:
+            # Pool threads do not see the submitting rerun's timing run, so
+            # each job is timed as a run of its own.
+            run = timing.begin_run({
+                "set": "/".join(os.path.normpath(job.base_folder).split(os.sep)[-3:]),
+                "job": job.kind,
+                "job_id": job_id,
+            })
+            self._update(job_id, status="running")
+            try:
+                result = HANDLERS[job.kind](
+                    self._open(job.base_folder),
+                    {**job.params, **secrets},
+                    lambda done, total: self._update(job_id, done=done, total=total),
+                )
+            except Exception as e:
+                self._update(job_id, status="failed", error=str(e) or type(e).__name__)
+            else:
+                self._update(job_id, status="done", result=json.dumps(result))
+            finally:
+                timing.finish_run(run)
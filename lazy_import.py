@@ -0,0 +1,36 @@
+import importlib
+import importlib.util
+
+import timing
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Module-level ``pd = lazy_import.module("pandas")`` keeps the import out
+    of process start-up, so the Streamlit server and every spawned worker
+    only pay for the libraries their code actually touches.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            with timing.span(f"import.{self._name}"):
+                module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self._module is None else ' (loaded)'}>"
+
+
+def module(name):
+    return LazyModule(name)
+
+
+def installed(name):
+    """Whether a top-level package can be imported, without importing it."""
+    return importlib.util.find_spec(name) is not None
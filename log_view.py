@@ -0,0 +1,161 @@
+import threading
+
+import lazy_import
+import signing_log
+import timing
+
+np = lazy_import.module("numpy")
+pd = lazy_import.module("pandas")
+pa = lazy_import.module("pyarrow")
+pc = lazy_import.module("pyarrow.compute")
+
+PAGE_SIZE = 100
+UNSIGNED = "Unsigned"
+STAGE_FILTERS = (UNSIGNED, *signing_log.STAGE_COLUMNS)
+STATUS_FILTERS = {"Pass": "PASS", "Fail": "FAIL", "Not run": ""}
+STATUS_COLOURS = {"PASS": "#d4edda", "FAIL": "#f8d7da"}
+
+# Derived columns: the stage a row has reached is shown in the grid; the
+# others only drive filtering and colouring and never reach the browser.
+STAGE_KEY = "Stage"
+STATUS_KEY = "_status"
+SIGNED_ON_KEY = "_signed_on"
+HIDDEN_COLUMNS = [STATUS_KEY, SIGNED_ON_KEY]
+
+_lock = threading.Lock()
+_tables = {}  # excel_path -> (log_stamp, table)
+
+
+def _blank(values):
+    return values.isna() | (values.astype(str).str.strip() == "")
+
+
+def _build(excel_path):
+    log_data = signing_log.load_log(excel_path)
+    columns = log_data.columns
+    stage = pd.Series(UNSIGNED, index=log_data.index, dtype=object)
+    signed_on = pd.Series(pd.NaT, index=log_data.index, dtype="datetime64[ns]")
+    for name, (signer_column, date_column) in signing_log.STAGE_COLUMNS.items():
+        signed = ~_blank(log_data[columns[signer_column]])
+        stage = stage.mask(signed, name)
+        dates = pd.to_datetime(log_data[columns[date_column]].astype(object), errors="coerce", format="mixed")
+        signed_on = signed_on.mask(signed & dates.notna(), dates)
+    status = log_data[columns[signing_log.STATUS_COLUMN]]
+    log_data.insert(0, STAGE_KEY, stage)
+    log_data[STATUS_KEY] = status.astype(object).where(status.notna(), "").astype(str).str.strip().str.upper()
+    log_data[SIGNED_ON_KEY] = signed_on
+    # Hand-edited columns can hold numbers next to text; Arrow needs one type.
+    for column in log_data.columns:
+        if log_data[column].dtype == object:
+            log_data[column] = log_data[column].map(lambda value: value if pd.isna(value) else str(value))
+    return pa.Table.from_pandas(log_data, preserve_index=False)
+
+
+def log_table(excel_path):
+    """The signing log, pending signatures included, as an Arrow table.
+
+    Rebuilt only when the xlsx or its journal changes.  Column 0 is the
+    stage each row has reached; STATUS_KEY and SIGNED_ON_KEY are appended.
+    """
+    stamp = signing_log.log_stamp(excel_path)
+    with _lock:
+        cached = _tables.get(excel_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    with timing.span("log_view.build"):
+        table = _build(excel_path)
+    with _lock:
+        _tables[excel_path] = (stamp, table)
+    return table
+
+
+def _log_column(table, column):
+    # Offset by the stage column log_table() puts in front.
+    return table.column_names[column + 1]
+
+
+def signers(table):
+    """Everyone who has signed any stage, for the signer filter."""
+    names = set()
+    for signer_column, _ in signing_log.STAGE_COLUMNS.values():
+        values = table.column(_log_column(table, signer_column))
+        if pa.types.is_string(values.type):
+            names.update(name.strip() for name in pc.unique(values).to_pylist() if name and name.strip())
+    return sorted(names, key=str.lower)
+
+
+def date_bounds(table):
+    """The first and last signing dates in the log, or None if nothing is signed."""
+    bounds = pc.min_max(table.column(SIGNED_ON_KEY))
+    if not bounds["min"].is_valid:
+        return None
+    return bounds["min"].as_py().date(), bounds["max"].as_py().date()
+
+
+def _any_of(masks):
+    mask = masks[0]
+    for other in masks[1:]:
+        mask = pc.or_(mask, other)
+    return mask
+
+
+def select(table, signer_names=(), dates=None, statuses=(), stages=()):
+    """The rows of the log matching every given filter.
+
+    signer_names match the signer of any stage, dates is an inclusive
+    (first, last) pair of signing days, statuses are STATUS_FILTERS keys and
+    stages STAGE_FILTERS entries.
+    """
+    masks = []
+    if signer_names:
+        wanted = pa.array(list(signer_names), pa.string())
+        masks.append(_any_of([
+            pc.is_in(pc.utf8_trim_whitespace(table.column(_log_column(table, signer_column)).cast(pa.string())),
+                     value_set=wanted)
+            for signer_column, _ in signing_log.STAGE_COLUMNS.values()
+        ]))
+    if dates:
+        signed_on = table.column(SIGNED_ON_KEY)
+        first = pa.scalar(pd.Timestamp(dates[0]), signed_on.type)
+        after_last = pa.scalar(pd.Timestamp(dates[1]) + pd.Timedelta(days=1), signed_on.type)
+        masks.append(pc.and_(pc.greater_equal(signed_on, first), pc.less(signed_on, after_last)))
+    if statuses:
+        masks.append(pc.is_in(table.column(STATUS_KEY),
+                              value_set=pa.array([STATUS_FILTERS[status] for status in statuses])))
+    if stages:
+        masks.append(pc.is_in(table.column(STAGE_KEY), value_set=pa.array(list(stages), pa.string())))
+    if not masks:
+        return table
+    with timing.span("log_view.filter"):
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = pc.and_(mask, other)
+        return table.filter(pc.fill_null(mask, False))
+
+
+def page(table, sort=None, descending=False, offset=0, limit=PAGE_SIZE):
+    """One page of rows as a DataFrame, sorted by a column or in log order.
+
+    Only the rows on the page are converted to pandas.
+    """
+    with timing.span("log_view.page"):
+        if sort:
+            order = "descending" if descending else "ascending"
+            indices = pc.sort_indices(table, sort_keys=[(sort, order)])
+            table = table.take(indices[offset:offset + limit])
+        else:
+            table = table.slice(offset, limit)
+        return table.to_pandas()
+
+
+def styled(rows):
+    """The page without hidden columns, rows coloured by PASS/FAIL status.
+
+    The colours are worked out once for the status column and broadcast,
+    instead of calling a Python function per row.
+    """
+    shown = rows.drop(columns=HIDDEN_COLUMNS)
+    colours = rows[STATUS_KEY].map(STATUS_COLOURS)
+    css = ("background-color: " + colours).fillna("").to_numpy()
+    styles = pd.DataFrame(np.repeat(css[:, None], shown.shape[1], axis=1), index=shown.index, columns=shown.columns)
+    return shown.style.apply(lambda _: styles, axis=None)
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+import urllib.parse
+
+import tornado.web
+
+PORT = int(os.environ.get("QTG_PDF_PORT", "8502"))
+ADDRESS = os.environ.get("QTG_PDF_ADDRESS", "")
+# Set when the app sits behind a proxy, e.g. https://qtg.example.com/files
+BASE_URL = os.environ.get("QTG_PDF_BASE_URL", "")
+
+# StaticFileHandler streams files in 64 KiB chunks and waits for each chunk to
+# be flushed, so every open stream holds at most one chunk in memory.
+CHUNK_SIZE = 64 * 1024
+SESSION_MEMORY_CEILING = int(os.environ.get("QTG_PDF_SESSION_BYTES", str(512 * 1024)))
+MAX_STREAMS_PER_SESSION = max(1, SESSION_MEMORY_CEILING // CHUNK_SIZE)
+# A URL stops working this long after the app last showed it, so links
+# that leak (history, proxy logs) do not outlive the session for long.
+TOKEN_TTL_S = float(os.environ.get("QTG_PDF_TOKEN_TTL_S", "3600"))
+PRUNE_INTERVAL_S = 60
+
+_lock = threading.Lock()
+_tokens = {}  # token -> (absolute path, session id, expiry on the monotonic clock)
+_session_tokens = {}  # (session id, absolute path) -> token
+_pruned_at = 0.0
+_active_streams = {}  # session id -> open responses
+_started = None
+
+
+class PDFHandler(tornado.web.StaticFileHandler):
+    """Serves registered PDFs by token with HTTP range support."""
+
+    _session = None
+
+    def prepare(self):
+        token = self.path_args[0].split("/", 1)[0]
+        with _lock:
+            entry = _live(token)
+            if entry is None:
+                raise tornado.web.HTTPError(404)
+            session = entry[1]
+            if _active_streams.get(session, 0) >= MAX_STREAMS_PER_SESSION:
+                raise tornado.web.HTTPError(429, reason="Too many open PDF downloads for this session")
+            _active_streams[session] = _active_streams.get(session, 0) + 1
+            self._session = session
+
+    def on_finish(self):
+        self._release()
+
+    def on_connection_close(self):
+        self._release()
+        super().on_connection_close()
+
+    def _release(self):
+        with _lock:
+            if self._session is not None:
+                _active_streams[self._session] -= 1
+                self._session = None
+
+    def parse_url_path(self, url_path):
+        return url_path
+
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        with _lock:
+            entry = _live(path.split("/", 1)[0])
+        return entry[0] if entry else ""
+
+    def validate_absolute_path(self, root, absolute_path):
+        if not os.path.isfile(absolute_path):
+            raise tornado.web.HTTPError(404)
+        return absolute_path
+
+    def set_extra_headers(self, path):
+        disposition = "attachment" if self.get_query_argument("download", None) else "inline"
+        filename = urllib.parse.quote(os.path.basename(self.absolute_path))
+        self.set_header("Content-Disposition", f"{disposition}; filename*=UTF-8''{filename}")
+        self.set_header("Cache-Control", "no-store")
+
+
+def _live(token):
+    """The (path, session id, expiry) of an unexpired token, or None.  Call with _lock held."""
+    entry = _tokens.get(token)
+    if entry is None or entry[2] < time.monotonic():
+        return None
+    return entry
+
+
+def _prune(now):
+    """Forget expired tokens.  Call with _lock held."""
+    global _pruned_at
+    _pruned_at = now
+    for token, (path, session_id, expires_at) in list(_tokens.items()):
+        if expires_at < now:
+            del _tokens[token]
+            del _session_tokens[(session_id, path)]
+    for session_id in [session_id for session_id, streams in _active_streams.items() if not streams]:
+        del _active_streams[session_id]
+
+
+def _run(ready):
+    async def main():
+        app = tornado.web.Application([(r"/pdf/(.*)", PDFHandler, {"path": os.sep})])
+        try:
+            app.listen(PORT, ADDRESS)
+        except OSError as e:
+            ready.append(e)
+            return
+        ready.append(None)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def start():
+    """Start the file server once per process; return True if it is serving."""
+    global _started
+    with _lock:
+        if _started is None:
+            ready = []
+            thread = threading.Thread(target=_run, args=(ready,), name="qtg-pdf-server", daemon=True)
+            thread.start()
+            while not ready and thread.is_alive():
+                thread.join(0.05)
+            _started = bool(ready) and ready[0] is None
+        return _started
+
+
+def url_for(path, session_id, host=None, download=False):
+    """Register path for session_id and return a URL that streams it.
+
+    Nothing is read from disk until the browser requests the URL.  The URL
+    expires TOKEN_TTL_S after the last call for the same path and session.
+    """
+    path = os.path.abspath(path)
+    now = time.monotonic()
+    with _lock:
+        if now - _pruned_at > PRUNE_INTERVAL_S:
+            _prune(now)
+        token = _session_tokens.get((session_id, path))
+        if token is None or _live(token) is None:
+            _tokens.pop(token, None)
+            token = secrets.token_urlsafe(16)
+            _session_tokens[(session_id, path)] = token
+        _tokens[token] = (path, session_id, now + TOKEN_TTL_S)
+    if BASE_URL:
+        base = BASE_URL.rstrip("/")
+    else:
+        hostname = urllib.parse.urlsplit(f"//{host or 'localhost'}").hostname
+        if ":" in hostname:
+            hostname = f"[{hostname}]"
+        base = f"http://{hostname}:{PORT}"
+    url = f"{base}/pdf/{token}/{urllib.parse.quote(os.path.basename(path))}"
+    return url + "?download=1" if download else url
@@ -0,0 +1,229 @@
+"""Run the QTG workflow without the Streamlit UI.
+
+Examples:
+    python qtg_cli.py ingest "FFS/2024/Set A" simulator_output/*.pdf
+    python qtg_cli.py triage "FFS/2024/Set A" manifest.csv
+    python qtg_cli.py sign "FFS/2024/Set A" --signer "J. Smith" --all
+    python qtg_cli.py sign "FFS/2024/Set A" --signer "J. Smith" --certify --certificate smith.p12 --all
+    python qtg_cli.py sign "FFS/2024/Set A" --stage EAT --signer "A. Khan" --all
+    python qtg_cli.py rebuild-log FFS/2024/*
+    python qtg_cli.py rebuild-signatures FFS/2024/*
+    python qtg_cli.py search "pitch trim"
+    QTG_BLOB_STORE=.qtg_store python qtg_cli.py dedupe FFS/*/* FTD/*/*
+"""
+import argparse
+import csv
+import getpass
+import os
+import sys
+
+import blob_store
+import cert_signing
+import qtg_signing
+import search_index
+import signer_profiles
+from qtg_core import QTGSet
+
+
+def report(done, failures):
+    print(f"{len(done)} succeeded, {len(failures)} failed")
+    for name, error in failures:
+        print(f"  {name}: {error}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def cmd_ingest(args):
+    qtg_set = QTGSet(args.set_folder)
+    qtg_set.index.reconcile()
+    return report(*qtg_set.ingest(args.files, move=args.move))
+
+
+def cmd_triage(args):
+    """Apply a manifest of 'file,status' rows, status being Pass, Fail or Source."""
+    qtg_set = QTGSet(args.set_folder)
+    qtg_set.index.reconcile()
+    folders = {
+        "source": qtg_set.source_folder,
+        "pass": qtg_set.pass_folder,
+        "fail": qtg_set.fail_folder,
+    }
+    located = {}
+    for folder in folders.values():
+        for name in qtg_set.list_files(folder):
+            located[name] = folder
+
+    wanted = {}
+    with open(args.manifest, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() in ("file", "file name"):
+                continue
+            wanted[row[0].strip()] = row[1].strip().lower()
+
+    moved, failures = [], []
+    batches = {}
+    for name, status in wanted.items():
+        if status not in folders:
+            failures.append((name, ValueError(f"unknown status '{status}'")))
+        elif name not in located:
+            failures.append((name, FileNotFoundError("not in the source, pass or fail folder")))
+        elif located[name] != folders[status]:
+            batches.setdefault((located[name], folders[status]), []).append(name)
+    for (src_folder, dest_folder), names in batches.items():
+        done, failed = qtg_set.move_files(names, src_folder, dest_folder)
+        moved += done
+        failures += failed
+    return report(moved, failures)
+
+
+def cmd_sign(args):
+    qtg_set = QTGSet(args.set_folder)
+    qtg_set.index.reconcile()
+    if not args.signature and not signer_profiles.has_profile(args.signer):
+        print(f"No saved signature for {args.signer}; pass --signature.", file=sys.stderr)
+        return 2
+    pin = os.environ.get("QTG_SIGNER_PIN")
+    if pin is None:
+        pin = getpass.getpass(f"Signature PIN for {args.signer}: ")
+    try:
+        if args.signature:
+            with open(args.signature, "rb") as f:
+                signer_profiles.save_profile(args.signer, f.read(), pin)
+        else:
+            signer_profiles.verify_pin(args.signer, pin)
+        if args.certify and args.certificate:
+            with open(args.certificate, "rb") as f:
+                signer_profiles.save_certificate(args.signer, f.read(), pin)
+    except (ValueError, signer_profiles.ProfileLocked) as e:
+        print(e, file=sys.stderr)
+        return 2
+    certificate = None
+    if args.certify:
+        passphrase = os.environ.get("QTG_CERT_PASSPHRASE")
+        if passphrase is None:
+            passphrase = getpass.getpass(f"Certificate passphrase for {args.signer}: ")
+        certificate = (signer_profiles.certificate_path(args.signer), passphrase)
+        try:
+            cert_signing.load_signer(*certificate)
+        except cert_signing.CertificateError as e:
+            print(e, file=sys.stderr)
+            return 2
+    names = qtg_set.stage_queue(args.stage) if args.all else args.files
+    if not names:
+        print("Nothing to sign.")
+        return 0
+
+    def progress(done, total):
+        print(f"\rSigning {done}/{total}", end="", file=sys.stderr, flush=True)
+
+    signed, failures = qtg_set.sign_files_in_batch(
+        [os.path.join(qtg_set.stage_folders(args.stage)[0], name) for name in names],
+        signer_profiles.signature_bytes(args.signer),
+        args.signer,
+        args.remarks,
+        progress=progress,
+        max_workers=args.workers,
+        certificate=certificate,
+        stage=args.stage,
+    )
+    print(file=sys.stderr)
+    return report(signed, failures)
+
+
+def cmd_rebuild_log(args):
+    for set_folder in args.set_folders:
+        print(f"{set_folder}: applied {QTGSet(set_folder).rebuild_log()} journal entries")
+    return 0
+
+
+def cmd_rebuild_signatures(args):
+    for set_folder in args.set_folders:
+        print(f"{set_folder}: {QTGSet(set_folder).rebuild_signatures()} signed PDFs carry stage records")
+    return 0
+
+
+def cmd_search(args):
+    index = search_index.SearchIndex(args.root)
+    read = index.refresh()
+    print(f"Indexed {read} new or changed PDFs", file=sys.stderr)
+    for kind, device, year, set_name, state, name, snippet in index.search(" ".join(args.query)):
+        where = f"{device}/{year}/{set_name}" + (f" [{state}]" if state else " [signing log]")
+        print(f"{where} {name}: {' '.join(snippet.split())}")
+    return 0
+
+
+def cmd_dedupe(args):
+    if not blob_store.enabled():
+        print("Set QTG_BLOB_STORE to a directory on the same filesystem first.", file=sys.stderr)
+        return 2
+    for set_folder in args.set_folders:
+        qtg_set = QTGSet(set_folder)
+        files, saved = blob_store.dedupe(qtg_set.index.folders.values())
+        print(f"{set_folder}: {files} files, {saved / 1024 / 1024:.1f} MiB saved")
+    return 0
+
+
+def cmd_gc(args):
+    if not blob_store.enabled():
+        print("QTG_BLOB_STORE is not set.", file=sys.stderr)
+        return 2
+    blobs, freed = blob_store.gc()
+    print(f"Removed {blobs} unreferenced blobs, {freed / 1024 / 1024:.1f} MiB freed")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add simulator output to a set's source folder")
+    ingest.add_argument("set_folder")
+    ingest.add_argument("files", nargs="+")
+    ingest.add_argument("--move", action="store_true", help="move instead of copy")
+    ingest.set_defaults(func=cmd_ingest)
+
+    triage = commands.add_parser("triage", help="move files to Pass/Fail/Source from a CSV manifest")
+    triage.add_argument("set_folder")
+    triage.add_argument("manifest")
+    triage.set_defaults(func=cmd_triage)
+
+    sign = commands.add_parser("sign", help="sign documents for a review stage")
+    sign.add_argument("set_folder")
+    sign.add_argument("files", nargs="*", help="file names in the stage's folder (Pass for CAE, signed for EAT)")
+    sign.add_argument("--all", action="store_true", help="sign everything waiting for the stage")
+    sign.add_argument("--stage", choices=qtg_signing.STAGES, default=qtg_signing.DEFAULT_STAGE)
+    sign.add_argument("--signer", required=True,
+                      help="whose saved profile to use; its PIN is read from QTG_SIGNER_PIN or prompted")
+    sign.add_argument("--signature", help="signature image; saved to the signer's profile")
+    sign.add_argument("--remarks", default="")
+    sign.add_argument("--certify", action="store_true",
+                      help="also add a PAdES signature; the passphrase is read from QTG_CERT_PASSPHRASE or prompted")
+    sign.add_argument("--certificate", help="PKCS#12 file; saved to the signer's profile")
+    sign.add_argument("--workers", type=int, default=None)
+    sign.set_defaults(func=cmd_sign)
+
+    rebuild = commands.add_parser("rebuild-log", help="write journalled signatures into signing_log.xlsx")
+    rebuild.add_argument("set_folders", nargs="+")
+    rebuild.set_defaults(func=cmd_rebuild_log)
+
+    stages = commands.add_parser("rebuild-signatures", help="re-read signature stages from the signed PDFs")
+    stages.add_argument("set_folders", nargs="+")
+    stages.set_defaults(func=cmd_rebuild_signatures)
+
+    search = commands.add_parser("search", help="full-text search across every set")
+    search.add_argument("query", nargs="+")
+    search.add_argument("--root", default=".", help="folder holding the device directories")
+    search.set_defaults(func=cmd_search)
+
+    dedupe = commands.add_parser("dedupe", help="move sets' PDFs into the blob store ($QTG_BLOB_STORE)")
+    dedupe.add_argument("set_folders", nargs="+")
+    dedupe.set_defaults(func=cmd_dedupe)
+
+    gc = commands.add_parser("gc", help="delete blobs no set folder links to")
+    gc.set_defaults(func=cmd_gc)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+import os
+import shutil
+
+import blob_store
+import file_locks
+import lazy_import
+import qtg_signing
+import signing_log
+import timing
+from qtg_index import FOLDER_NAMES, QTGIndex
+
+pd = lazy_import.module("pandas")
+
+LOG_FILE = "signing_log.xlsx"
+
+# The folder each review stage signs documents from and the one it signs into.
+STAGE_FOLDERS = {"CAE": ("pass", "signed"), "EAT": ("signed", "countersigned")}
+
+
+class QTGError(Exception):
+    """A workflow step that failed for a reason worth showing to the user."""
+
+
+class LogEntryNotFound(QTGError, LookupError):
+    def __init__(self, file_name):
+        super().__init__(f"File '{file_name}' not found in Excel log.")
+        self.file_name = file_name
+
+
+def log_name(pdf_path):
+    """The Test Title a PDF is listed under in the signing log."""
+    return os.path.basename(pdf_path).replace(".pdf", "")
+
+
+def discover_sets(root="."):
+    """Yield (device, year, set_name, base_folder) for every set under root."""
+    for device in sorted(os.listdir(root)):
+        device_folder = os.path.join(root, device)
+        if device.startswith(".") or not os.path.isdir(device_folder):
+            continue
+        for year in sorted(os.listdir(device_folder)):
+            year_folder = os.path.join(device_folder, year)
+            if not os.path.isdir(year_folder):
+                continue
+            for set_name in sorted(os.listdir(year_folder)):
+                base_folder = os.path.join(year_folder, set_name)
+                if os.path.isdir(os.path.join(base_folder, FOLDER_NAMES["source"])):
+                    yield device, year, set_name, base_folder
+
+
+class QTGSet:
+    """One device/year/set folder and the workflow operations on it.
+
+    Nothing here talks to Streamlit: failures are raised or returned so the
+    app, the CLI and batch jobs can all report them their own way.
+    """
+
+    def __init__(self, base_folder, index=None):
+        self.base_folder = base_folder
+        self.index = index or QTGIndex(base_folder)
+        self.source_folder = self.index.folders["source"]
+        self.pass_folder = self.index.folders["pass"]
+        self.fail_folder = self.index.folders["fail"]
+        self.signed_folder = self.index.folders["signed"]
+        self.countersigned_folder = self.index.folders["countersigned"]
+        self.log_file = os.path.join(base_folder, LOG_FILE)
+        for folder in self.index.folders.values():
+            file_locks.recover_claims(folder)
+
+    @classmethod
+    def open(cls, root, device, year, set_name):
+        return cls(os.path.join(root, device, year, set_name))
+
+    def folder(self, state):
+        return self.index.folders[state]
+
+    def list_files(self, folder):
+        """List files in a folder."""
+        return self.index.list_files(folder)
+
+    def stage_folders(self, stage):
+        """The (from, into) folders of a review stage."""
+        src, dest = STAGE_FOLDERS[stage]
+        return self.folder(src), self.folder(dest)
+
+    def stage_queue(self, stage):
+        """Names waiting for a stage: in its folder and signed for every earlier stage.
+
+        Answered from the index alone; no PDF is opened.
+        """
+        position = qtg_signing.STAGES.index(stage)
+        previous = qtg_signing.STAGES[position - 1] if position else None
+        return self.index.awaiting(self.stage_folders(stage)[0], stage, after=previous)
+
+    def move_file(self, src, dest):
+        file_locks.claim(src, dest)
+        self.index.moved(src, dest)
+
+    def move_files(self, names, src_folder, dest_folder):
+        """Move files between folders of the set as one batch of claims.
+
+        Returns the moved names and a list of (name, error) for the rest,
+        including files another reviewer moved first.
+        """
+        moved, failures, moves = [], [], []
+        for name in names:
+            src_path = os.path.join(src_folder, name)
+            dest_path = os.path.join(dest_folder, name)
+            try:
+                file_locks.claim(src_path, dest_path)
+            except FileExistsError:
+                failures.append((name, FileExistsError(f"'{name}' already exists in the destination folder")))
+            except FileNotFoundError:
+                failures.append((name, FileNotFoundError(f"'{name}' was moved by someone else")))
+            except OSError as e:
+                failures.append((name, e))
+            else:
+                moves.append((src_path, dest_path))
+                moved.append(name)
+        self.index.moved_many(moves)
+        return moved, failures
+
+    def retrieve_files(self, selected_files, src_folder, dest_folder=None):
+        return self.move_files(selected_files, src_folder, dest_folder or self.source_folder)
+
+    def ingest(self, paths, move=False):
+        """Copy (or move) PDFs into the source folder; return (added, failures).
+
+        With the blob store enabled, identical PDFs share one stored copy.
+        """
+        added, failures = [], []
+        for path in paths:
+            name = os.path.basename(path)
+            dest_path = os.path.join(self.source_folder, name)
+            try:
+                if os.path.exists(dest_path):
+                    raise FileExistsError(f"'{name}' already exists in the source folder")
+                if move:
+                    file_locks.claim(path, dest_path)
+                    if blob_store.enabled():
+                        try:
+                            blob_store.adopt(dest_path)
+                        except OSError:
+                            pass  # moved in all the same; `qtg_cli.py dedupe` can link it later
+                elif blob_store.enabled():
+                    blob_store.store_copy(path, dest_path)
+                else:
+                    shutil.copy2(path, dest_path)
+            except OSError as e:
+                failures.append((name, e))
+            else:
+                self.index.added(dest_path)
+                added.append(name)
+        return added, failures
+
+    def update_excel_log_batch(self, entries, stage=qtg_signing.DEFAULT_STAGE):
+        """Journal (file_name, signer_name, signing_date, remarks) entries in one commit.
+
+        Returns the file names recorded and those missing from the log.
+        The xlsx itself is regenerated from the journal on demand.
+        """
+        known = signing_log.log_file_names(self.log_file)
+        found = [entry for entry in entries if entry[0] in known]
+        signing_log.append_entries(self.log_file, found, stage)
+        updated = {entry[0] for entry in found}
+        return updated, sorted({entry[0] for entry in entries} - updated)
+
+    def update_excel_log_with_remarks(self, file_name, signer_name, signing_date, remarks,
+                                      stage=qtg_signing.DEFAULT_STAGE):
+        updated, _ = self.update_excel_log_batch([(file_name, signer_name, signing_date, remarks)], stage)
+        if file_name not in updated:
+            raise LogEntryNotFound(file_name)
+
+    def _take(self, pdf_path):
+        try:
+            return file_locks.take(pdf_path)
+        except FileNotFoundError:
+            raise QTGError(f"'{os.path.basename(pdf_path)}' was moved or signed by someone else.") from None
+
+    def _check_free(self, name, stage):
+        # A signed copy of an earlier QTG with the same name would be overwritten.
+        dest_folder = self.stage_folders(stage)[1]
+        if os.path.exists(os.path.join(dest_folder, name)):
+            raise QTGError(f"'{name}' is already in {os.path.basename(dest_folder)}; rename one of them first.")
+
+    def _discard(self, signed_file_path):
+        """Delete a signed copy whose stage change did not go through."""
+        try:
+            os.remove(signed_file_path)
+        except FileNotFoundError:
+            pass
+        self.index.removed(signed_file_path)
+
+    def add_signature_and_update_log(self, pdf_path, signature, signer_name, remarks, signer=None,
+                                     stage=qtg_signing.DEFAULT_STAGE):
+        """Sign one PDF for a stage, log it and move it on; return the signed path.
+
+        The source is taken first, so a concurrent move or second signer
+        fails cleanly instead of racing this one.  The signed copy goes to
+        the stage's destination folder; if logging fails it is deleted and
+        the source put back, so the document stays at its stage.  signer adds a certificate
+        signature, see qtg_signing.stamp_pdf().
+        """
+        name = os.path.basename(pdf_path)
+        if stage in self.index.stages(pdf_path):
+            raise QTGError(f"'{name}' is already signed for {stage}.")
+        self._check_free(name, stage)
+        claimed = self._take(pdf_path)
+        signed_file_path = None
+        try:
+            signed_file_path, signed_at = qtg_signing.stamp_pdf(
+                claimed, signature, self.stage_folders(stage)[1], name=name, signer=signer, stage=stage,
+                signer_name=signer_name,
+            )
+            self.index.added(signed_file_path)
+            self.update_excel_log_with_remarks(log_name(pdf_path), signer_name, signed_at, remarks, stage)
+            self.index.signed([(pdf_path, signed_file_path, stage, signer_name, signed_at)])
+        except BaseException:
+            if signed_file_path is not None:
+                self._discard(signed_file_path)
+            file_locks.put_back(claimed, pdf_path)
+            raise
+        file_locks.finish(claimed)
+        self.index.removed(pdf_path)
+        return signed_file_path
+
+    def sign_files_in_batch(self, pdf_paths, signature_bytes, signer_name, remarks, progress=None, max_workers=None,
+                            certificate=None, stage=qtg_signing.DEFAULT_STAGE):
+        """Sign many files for a stage in a process pool, then write the log once.
+
+        progress(done, total) is called as each document finishes.  certificate
+        is passed on to qtg_signing.sign_batch().  Signed copies that could
+        not be logged are deleted again.  Returns the logged file names and
+        a list of (name, error) for the rest.
+        """
+        taken, signed, copies, failures = {}, {}, {}, []
+        for pdf_path in pdf_paths:
+            if stage in self.index.stages(pdf_path):
+                failures.append((os.path.basename(pdf_path), QTGError(f"already signed for {stage}")))
+                continue
+            try:
+                self._check_free(os.path.basename(pdf_path), stage)
+                taken[self._take(pdf_path)] = pdf_path
+            except QTGError as e:
+                failures.append((os.path.basename(pdf_path), e))
+        logged, missing = set(), []
+        try:
+            batch = qtg_signing.sign_batch(
+                list(taken), signature_bytes, self.stage_folders(stage)[1], max_workers=max_workers,
+                names=[os.path.basename(pdf_path) for pdf_path in taken.values()], certificate=certificate,
+                stage=stage, signer_name=signer_name,
+            )
+            with timing.span("sign_batch"):
+                for done, (claimed, signed_file_path, signed_at, error) in enumerate(batch, start=1):
+                    pdf_path = taken[claimed]
+                    if error is None:
+                        copies[claimed] = signed_file_path
+                        self.index.added(signed_file_path)
+                        signed[log_name(pdf_path)] = (claimed, signed_at)
+                    else:
+                        failures.append((os.path.basename(pdf_path), error))
+                    if progress is not None:
+                        progress(done, len(taken))
+
+            entries = [(file_name, signer_name, signed_at, remarks) for file_name, (_, signed_at) in signed.items()]
+            logged, missing = self.update_excel_log_batch(entries, stage) if entries else (set(), [])
+            self.index.signed([
+                (taken[signed[file_name][0]], copies[signed[file_name][0]], stage, signer_name, signed[file_name][1])
+                for file_name in logged
+            ])
+        finally:
+            finished = {signed[file_name][0] for file_name in logged}
+            for claimed, pdf_path in taken.items():
+                if claimed in finished:
+                    file_locks.finish(claimed)
+                    self.index.removed(pdf_path)
+                else:
+                    if claimed in copies:
+                        self._discard(copies[claimed])
+                    file_locks.put_back(claimed, pdf_path)
+        failures.extend(
+            (os.path.basename(taken[signed[file_name][0]]), LogEntryNotFound(file_name)) for file_name in missing
+        )
+        return sorted(logged), failures
+
+    def rebuild_signatures(self):
+        """Re-read the stage records of every signed PDF into the index.
+
+        Only needed for files signed elsewhere or restored from a backup;
+        signing keeps the index current.  Signed files from before stages
+        were recorded count as first-stage signed if the log has a signer
+        for them.  Returns how many files carry a stage.
+        """
+        self.index.reconcile()
+        log_data = signing_log.load_log(self.log_file)
+        columns = log_data.columns
+        signer_column, date_column = signing_log.STAGE_COLUMNS[qtg_signing.DEFAULT_STAGE]
+        logged = {
+            title: (signer, None if pd.isna(signed_at) else str(signed_at))
+            for title, signer, signed_at in log_data[[
+                columns[signing_log.TITLE_COLUMN], columns[signer_column], columns[date_column]
+            ]].itertuples(index=False)
+            if not pd.isna(signer)
+        }
+        paths, records = [], []
+        for folder in (self.signed_folder, self.countersigned_folder):
+            for name in self.index.list_files(folder):
+                path = os.path.join(folder, name)
+                paths.append(path)
+                try:
+                    state = qtg_signing.signature_state(path)
+                except (RuntimeError, ValueError, OSError):
+                    continue
+                if not state and log_name(name) in logged:
+                    state = [{"stage": qtg_signing.DEFAULT_STAGE, "signer": logged[log_name(name)][0],
+                              "signed_at": logged[log_name(name)][1]}]
+                records += [
+                    (path, record["stage"], record.get("signer"), record.get("signed_at")) for record in state
+                ]
+        self.index.replace_signatures(paths, records)
+        return len({record[0] for record in records})
+
+    def rebuild_log(self):
+        """Write journalled signatures into the xlsx; return how many were applied."""
+        return signing_log.materialize(self.log_file)
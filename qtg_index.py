@@ -0,0 +1,408 @@
+import os
+import sqlite3
+import threading
+import time
+
+import file_locks
+import lazy_import
+import timing
+
+fitz = lazy_import.module("fitz")
+
+INDEX_FILE = ".qtg_index.sqlite3"
+
+FOLDER_NAMES = {
+    "source": "source_folder",
+    "pass": "pass_folder",
+    "fail": "fail_folder",
+    "signed": "signed_folder",
+    "countersigned": "countersigned_folder",
+}
+
+# A directory whose mtime is this close to "now" may still change within the
+# same timestamp tick, so it is rescanned on the next reconcile as well.
+RACY_WINDOW_NS = 2_000_000_000
+
+SORT_COLUMNS = {"name": "name", "size": "size", "modified": "mtime_ns"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    state TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    state TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (state, name)
+);
+CREATE TABLE IF NOT EXISTS claims (
+    state TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (state, name)
+);
+CREATE TABLE IF NOT EXISTS pdf_meta (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    pages INTEGER,
+    title TEXT
+);
+"""
+# Stage records belong to the file in one folder, not to a name: a QTG
+# re-run under the same name must not inherit the old copy's signatures.
+SIGNATURES = """
+CREATE TABLE IF NOT EXISTS signatures (
+    state TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    signer TEXT,
+    signed_at TEXT,
+    PRIMARY KEY (state, name, stage)
+);
+"""
+
+
+class QTGIndex:
+    """Persistent record of which QTG lives in which folder of one set.
+
+    The index is reconciled against the filesystem by comparing directory
+    mtimes, so an unchanged folder costs a single stat() per rerun.  The
+    helpers that move, add or remove files keep it up to date in between.
+    """
+
+    def __init__(self, base_folder):
+        self.base_folder = base_folder
+        self.folders = {state: os.path.join(base_folder, name) for state, name in FOLDER_NAMES.items()}
+        self._states = {os.path.normpath(path): state for state, path in self.folders.items()}
+        for folder in self.folders.values():
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(base_folder, INDEX_FILE), check_same_thread=False, isolation_level=None
+        )
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(signatures)")}
+        if columns and "state" not in columns:
+            self._migrate_signatures()
+        self.conn.executescript(SIGNATURES)
+
+    def _migrate_signatures(self):
+        # Records used to be keyed by name alone; give each to the signed
+        # files of that name, which is where they were read from.
+        try:
+            self.conn.executescript(
+                "BEGIN;"
+                "ALTER TABLE signatures RENAME TO signatures_by_name;"
+                + SIGNATURES +
+                "INSERT OR IGNORE INTO signatures "
+                "SELECT f.state, s.name, s.stage, s.signer, s.signed_at "
+                "FROM signatures_by_name s JOIN files f ON f.name = s.name "
+                "WHERE f.state IN ('signed', 'countersigned');"
+                "DROP TABLE signatures_by_name;"
+                "COMMIT;"
+            )
+        except sqlite3.OperationalError:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")  # another server migrated it first
+
+    def state_of(self, folder):
+        """Return the state name of a set folder, or None for foreign paths."""
+        return self._states.get(os.path.normpath(folder))
+
+    def reconcile(self):
+        """Rescan the folders whose mtime changed; return their states.
+
+        Claims seen by a rescan are remembered, and any whose holder has
+        since died are put back, so an interrupted move or signing shows up
+        again without waiting for a restart.
+        """
+        with self._lock, timing.span("index.reconcile"):
+            changed = self._reconcile()
+            recovered = {
+                state
+                for state, name in self.conn.execute("SELECT state, name FROM claims").fetchall()
+                if file_locks.recover_claim(os.path.join(self.folders[state], name)) is not None
+            }
+            if recovered:
+                changed = list(dict.fromkeys(changed + self._reconcile()))
+        return changed
+
+    def _reconcile(self):
+        changed = []
+        known = dict(self.conn.execute("SELECT state, mtime_ns FROM folders"))
+        for state, folder in self.folders.items():
+            try:
+                mtime_ns = os.stat(folder).st_mtime_ns
+            except FileNotFoundError:
+                os.makedirs(folder, exist_ok=True)
+                mtime_ns = os.stat(folder).st_mtime_ns
+            if state in known and known[state] == mtime_ns:
+                continue
+            self._rescan(state, folder, mtime_ns)
+            changed.append(state)
+        return changed
+
+    def _rescan(self, state, folder, mtime_ns):
+        rows, claims = [], []
+        with timing.span("os.scandir"), os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith(file_locks.CLAIM_PREFIX):
+                    claims.append((state, entry.name))
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                rows.append((state, entry.name, st.st_size, st.st_mtime_ns))
+        if time.time_ns() - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = None
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("DELETE FROM files WHERE state = ?", (state,))
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute(
+                "DELETE FROM signatures WHERE state = ? AND name NOT IN (SELECT name FROM files WHERE state = ?)",
+                (state, state),
+            )
+            self.conn.execute("DELETE FROM claims WHERE state = ?", (state,))
+            self.conn.executemany("INSERT INTO claims VALUES (?, ?)", claims)
+            self.conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (state, mtime_ns))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def list_files(self, folder):
+        """List the file names recorded for a set folder."""
+        state = self.state_of(folder)
+        with self._lock:
+            rows = self.conn.execute("SELECT name FROM files WHERE state = ? ORDER BY name", (state,))
+            return [name for (name,) in rows]
+
+    def counts(self):
+        """Return {state: number of files} for the set's folders."""
+        with self._lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM files GROUP BY state"))
+
+    def entries(self, folder):
+        """List (path, size, mtime_ns) for the files recorded in a set folder."""
+        state = self.state_of(folder)
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE state = ? ORDER BY name", (state,)
+            ).fetchall()
+        return [(os.path.join(folder, name), size, mtime_ns) for name, size, mtime_ns in rows]
+
+    def _filter(self, folder, name_filter):
+        pattern = name_filter.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return "state = ? AND name LIKE ? ESCAPE '\\'", (self.state_of(folder), f"%{pattern}%")
+
+    def count(self, folder, name_filter=""):
+        """Count the files in a set folder whose name contains name_filter."""
+        where, params = self._filter(folder, name_filter)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM files WHERE {where}", params).fetchone()[0]
+
+    def page(self, folder, offset=0, limit=None, sort="name", descending=False, name_filter=""):
+        """List (name, size, mtime_ns) for one sorted, filtered slice of a set folder."""
+        where, params = self._filter(folder, name_filter)
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT name, size, mtime_ns FROM files WHERE {where} "
+                f"ORDER BY {SORT_COLUMNS[sort]} {order}, name {order} LIMIT ? OFFSET ?",
+                (*params, -1 if limit is None else limit, offset),
+            ).fetchall()
+
+    def metadata(self, folder, rows):
+        """Return {name: (pages, title)} for page() rows.
+
+        Each PDF is opened at most once per (size, mtime); the result is kept
+        in the index, so only files that are actually shown are ever read.
+        """
+        result = {}
+        with self._lock:
+            for name, size, mtime_ns in rows:
+                cached = self.conn.execute(
+                    "SELECT pages, title FROM pdf_meta WHERE name = ? AND size = ? AND mtime_ns = ?",
+                    (name, size, mtime_ns),
+                ).fetchone()
+                if cached is not None:
+                    result[name] = cached
+        missing = [row for row in rows if row[0] not in result]
+        if not missing:
+            return result
+        read = []
+        with timing.span("pdf.metadata"):
+            for name, size, mtime_ns in missing:
+                try:
+                    with fitz.open(os.path.join(folder, name)) as doc:
+                        pages, title = doc.page_count, doc.metadata.get("title") or None
+                except (RuntimeError, ValueError, OSError):
+                    pages, title = None, None
+                result[name] = (pages, title)
+                read.append((name, size, mtime_ns, pages, title))
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO pdf_meta VALUES (?, ?, ?, ?, ?)", read)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _key(self, path):
+        return self.state_of(os.path.dirname(path)), os.path.basename(path)
+
+    def signed(self, records):
+        """Mirror (src, dest, stage, signer, signed_at) records written into signed PDFs.
+
+        The signed copy at dest carries every stage recorded for src, which
+        is dropped once src itself is removed, plus the new one.
+        """
+        carried, added = [], []
+        for src, dest, stage, signer, signed_at in records:
+            carried.append(self._key(dest) + self._key(src))
+            added.append(self._key(dest) + (stage, signer, signed_at))
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO signatures "
+                    "SELECT ?, ?, stage, signer, signed_at FROM signatures WHERE state = ? AND name = ?",
+                    carried,
+                )
+                self.conn.executemany("INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)", added)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def replace_signatures(self, paths, records):
+        """Make the (path, stage, signer, signed_at) records the only signature state of paths."""
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "DELETE FROM signatures WHERE state = ? AND name = ?", [self._key(path) for path in paths]
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)",
+                    [self._key(path) + tuple(record) for path, *record in records],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def stages(self, path):
+        """Return {stage: (signer, signed_at)} for the file at path."""
+        with self._lock:
+            return {
+                stage: (signer, signed_at)
+                for stage, signer, signed_at in self.conn.execute(
+                    "SELECT stage, signer, signed_at FROM signatures WHERE state = ? AND name = ?", self._key(path)
+                )
+            }
+
+    def awaiting(self, folder, stage, after=None):
+        """Names in a set folder not yet signed for stage (but signed for after, if given)."""
+        sql = (
+            "SELECT name FROM files f WHERE state = ? AND NOT EXISTS "
+            "(SELECT 1 FROM signatures s WHERE s.state = f.state AND s.name = f.name AND s.stage = ?)"
+        )
+        params = (self.state_of(folder), stage)
+        if after is not None:
+            sql += (
+                " AND EXISTS "
+                "(SELECT 1 FROM signatures s WHERE s.state = f.state AND s.name = f.name AND s.stage = ?)"
+            )
+            params += (after,)
+        with self._lock:
+            return [name for (name,) in self.conn.execute(sql + " ORDER BY name", params)]
+
+    def added(self, path):
+        """Record a file that was written into one of the set folders.
+
+        Whatever was recorded for a file of the same name there is dropped;
+        the stages of a signed copy are added with signed().
+        """
+        state = self.state_of(os.path.dirname(path))
+        if state is None:
+            return
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return  # already moved on by another session; reconcile catches up
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (state, os.path.basename(path), st.st_size, st.st_mtime_ns),
+                )
+                self.conn.execute(
+                    "DELETE FROM signatures WHERE state = ? AND name = ?", (state, os.path.basename(path))
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def removed(self, path):
+        """Record a file that was deleted from one of the set folders."""
+        state = self.state_of(os.path.dirname(path))
+        if state is None:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for table in ("files", "signatures"):
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE state = ? AND name = ?", (state, os.path.basename(path))
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def moved(self, src, dest):
+        """Record a move between two paths, either of which may be foreign."""
+        self.moved_many([(src, dest)])
+
+    def moved_many(self, moves):
+        """Record several (src, dest) moves in a single transaction.
+
+        Stage records move with the file; a file moved out of the set
+        takes them along.
+        """
+        removed, added, carried = [], [], []
+        for src, dest in moves:
+            state = self.state_of(os.path.dirname(src))
+            if state is not None:
+                removed.append((state, os.path.basename(src)))
+            dest_state = self.state_of(os.path.dirname(dest))
+            if dest_state is not None:
+                try:
+                    st = os.stat(dest)
+                except FileNotFoundError:
+                    continue  # already moved on by another session
+                added.append((dest_state, os.path.basename(dest), st.st_size, st.st_mtime_ns))
+                if state is not None:
+                    carried.append((dest_state, os.path.basename(dest), state, os.path.basename(src)))
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("DELETE FROM signatures WHERE state = ? AND name = ?", [row[:2] for row in added])
+                self.conn.executemany("UPDATE signatures SET state = ?, name = ? WHERE state = ? AND name = ?", carried)
+                self.conn.executemany("DELETE FROM signatures WHERE state = ? AND name = ?", removed)
+                self.conn.executemany("DELETE FROM files WHERE state = ? AND name = ?", removed)
+                self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", added)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,285 @@
+import datetime
+import json
+import os
+import re
+import shutil
+from concurrent.futures import as_completed
+from xml.sax.saxutils import escape, unescape
+
+import cert_signing
+import lazy_import
+import timing
+import worker_pool
+
+fitz = lazy_import.module("fitz")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+FICLONE = 0x40049409  # linux/fs.h: share extents on btrfs, XFS, bcachefs...
+
+# Review stages in signing order; the E-Sign flow signs the first one.
+STAGES = ("CAE", "EAT")
+DEFAULT_STAGE = STAGES[0]
+
+# Where each stage is stamped on page 0: the signature image and the
+# "Signed on" line.  Negative x is measured from the right edge, so EAT
+# sits top-right on any page size and never covers the CAE stamp.
+STAGE_RECTS = {
+    "CAE": ((50, 20, 200, 170), (50, 180, 250, 200)),
+    "EAT": ((-200, 20, -50, 170), (-200, 180, -50, 200)),
+}
+
+# Which stages a document carries is written into its XMP metadata when it
+# is signed, so it never has to be guessed from what is drawn on the page.
+XMP_NAMESPACE = "http://ns.qtg-review.local/signatures/1.0/"
+XMP_PACKET = (
+    '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+    '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+    '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"></rdf:RDF>'
+    '</x:xmpmeta><?xpacket end="w"?>'
+)
+_XMP_DESCRIPTION = re.compile(r"<rdf:Description[^>]*xmlns:qtg=[^>]*>.*?</rdf:Description>", re.S)
+_XMP_SIGNATURES = re.compile(r"<qtg:signatures>(.*?)</qtg:signatures>", re.S)
+
+
+class AlreadySigned(ValueError):
+    pass
+
+
+def timestamp():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def clone_file(src, dest):
+    """Copy src to dest as cheaply as the filesystem allows.
+
+    Tries a reflink (no data copied), then an in-kernel copy_file_range,
+    then a regular copy.  Returns the method that was used.
+    """
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                return "reflink"
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdest.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return "copy_file_range"
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdest.seek(0)
+            fdest.truncate()
+        shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+        return "copy"
+
+
+def insertable_signature(data):
+    """Turn stored signature bytes into the cheapest form to insert.
+
+    JPEG streams are embedded as-is without decoding; PNGs (kept for
+    transparency) are decoded once into a Pixmap.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return fitz.Pixmap(data)
+    return data
+
+
+def read_signatures(doc):
+    """Return the [{"stage", "signer", "signed_at"}] records of an open PDF."""
+    match = _XMP_SIGNATURES.search(doc.get_xml_metadata() or "")
+    return json.loads(unescape(match.group(1))) if match else []
+
+
+def _write_signatures(doc, records):
+    description = (
+        f'<rdf:Description rdf:about="" xmlns:qtg="{XMP_NAMESPACE}">'
+        f"<qtg:signatures>{escape(json.dumps(records))}</qtg:signatures></rdf:Description>"
+    )
+    xmp = _XMP_DESCRIPTION.sub("", doc.get_xml_metadata() or "")
+    if "</rdf:RDF>" not in xmp:
+        xmp = XMP_PACKET
+    doc.set_xml_metadata(xmp.replace("</rdf:RDF>", description + "</rdf:RDF>", 1))
+
+
+def signature_state(pdf_path):
+    """The signature records of a PDF; reads the metadata stream, not the pages."""
+    with fitz.open(pdf_path) as doc:
+        return read_signatures(doc)
+
+
+def stamp_size(stage):
+    """Width and height of a stage's signature box, in points."""
+    x0, y0, x1, y1 = STAGE_RECTS[stage][0]
+    return x1 - x0, y1 - y0
+
+
+def _stage_rect(page, rect):
+    x0, y0, x1, y1 = rect
+    width = page.rect.width
+    return fitz.Rect(x0 + width if x0 < 0 else x0, y0, x1 + width if x1 <= 0 else x1, y1)
+
+
+def _image_bytes(signature):
+    if isinstance(signature, fitz.Pixmap):
+        return signature.tobytes("png")
+    if isinstance(signature, bytes):
+        return signature
+    with open(signature, "rb") as f:
+        return f.read()
+
+
+def _stamp_page(doc, signature, signed_at, stage, signer_name, signer=None):
+    """Stamp page 0 for a stage and record it in the XMP metadata.
+
+    A document that already carries a certificate signature is not drawn
+    on: changed page content would make that signature report the
+    document as modified.  The stamp then becomes the appearance of the
+    new certificate signature, and (image, box, text) for
+    cert_signing.certify() is returned; otherwise None.
+    """
+    records = read_signatures(doc)
+    if any(record["stage"] == stage for record in records):
+        raise AlreadySigned(f"Already signed for {stage}.")
+    page = doc[0]
+    signature_rect, signed_on_rect = (_stage_rect(page, rect) for rect in STAGE_RECTS[stage])
+    text = f"Signed on: {signed_at}"
+    appearance = None
+    if doc.get_sigflags() > 0:
+        if signer is None:
+            raise cert_signing.CertificateError(
+                f"This document has a certificate signature; sign {stage} with a certificate as well."
+            )
+        box = (signature_rect | signed_on_rect) * ~page.transformation_matrix
+        appearance = (_image_bytes(signature), tuple(round(value) for value in box), text)
+    elif isinstance(signature, fitz.Pixmap):
+        page.insert_image(signature_rect, pixmap=signature)
+    elif isinstance(signature, bytes):
+        page.insert_image(signature_rect, stream=signature)
+    else:
+        page.insert_image(signature_rect, filename=signature)
+    if appearance is None:
+        page.insert_text(signed_on_rect.tl, text, fontsize=10)
+    _write_signatures(doc, records + [{"stage": stage, "signer": signer_name, "signed_at": signed_at}])
+    return appearance
+
+
+def stamp_pdf(pdf_path, signature, signed_folder, incremental=True, name=None, signer=None,
+              stage=DEFAULT_STAGE, signer_name=None):
+    """Stamp page 0 of a PDF and save it to signed_folder.
+
+    signature is an image path or a result of insertable_signature().  The
+    signed copy is named name, or after pdf_path if not given.  With a
+    signer from cert_signing.load_signer() the stamped copy is also given
+    a PAdES signature, appended after the stamp so that it covers it.
+    On a document that already has one (e.g. certified at CAE and now
+    signed for EAT) the stamp is drawn by the new signature instead of on
+    the page, which keeps the earlier signature valid; such documents
+    need a signer for every later stage.
+
+    The stage and signer_name are recorded in the XMP metadata; signing a
+    stage the document already carries raises AlreadySigned.
+
+    With incremental=True the source is cloned and the stamp is appended as
+    an incremental update, so the original objects are neither rewritten
+    nor recompressed.  Documents that cannot be updated incrementally (e.g.
+    ones MuPDF had to repair) fall back to a full save.
+
+    Returns the signed file path and the time that was written on the page.
+    """
+    signed_at = timestamp()
+    name = name or os.path.basename(pdf_path)
+    signed_file_path = os.path.join(signed_folder, name)
+    partial_path = os.path.join(signed_folder, f".{name}.partial")
+    try:
+        if incremental:
+            with timing.span("clone_file"):
+                clone_file(pdf_path, partial_path)
+            with timing.span("fitz.open"):
+                doc = fitz.open(partial_path)
+            try:
+                if doc.can_save_incrementally():
+                    appearance = _stamp_page(doc, signature, signed_at, stage, signer_name, signer)
+                    # Only the new objects are written; deflate keeps the
+                    # stamp image from being appended uncompressed.
+                    with timing.span("doc.save"):
+                        doc.save(partial_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
+                else:
+                    incremental = False
+            finally:
+                doc.close()
+        if not incremental:
+            with timing.span("fitz.open"):
+                doc = fitz.open(pdf_path)
+            try:
+                appearance = _stamp_page(doc, signature, signed_at, stage, signer_name, signer)
+                with timing.span("doc.save"):
+                    doc.save(partial_path)
+            finally:
+                doc.close()
+        if signer is not None:
+            with timing.span("pades.certify"):
+                cert_signing.certify(partial_path, signer, appearance=appearance)
+        os.replace(partial_path, signed_file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return signed_file_path, signed_at
+
+
+_worker_signature = None
+_worker_signer = None
+
+
+def _init_worker(signature_bytes, certificate=None):
+    global _worker_signature, _worker_signer
+    _worker_signature = insertable_signature(signature_bytes)
+    if certificate is not None:
+        _worker_signer = cert_signing.load_signer(*certificate)
+
+
+def _stamp_in_worker(pdf_path, signed_folder, incremental, name, stage, signer_name):
+    return stamp_pdf(pdf_path, _worker_signature, signed_folder, incremental, name, _worker_signer, stage, signer_name)
+
+
+def sign_batch(pdf_paths, signature_bytes, signed_folder, max_workers=None, incremental=True, names=None,
+               certificate=None, stage=DEFAULT_STAGE, signer_name=None):
+    """Stamp many PDFs in a process pool.
+
+    The stored signature is sent to and prepared by each worker once, then
+    reused for every document that worker signs.  certificate, if given, is
+    a (PKCS#12 path, passphrase) pair; each worker likewise opens the key
+    once and adds a PAdES signature to every document.  names, if given,
+    are the signed file names for pdf_paths in order.  stage and
+    signer_name are recorded as in stamp_pdf().
+
+    Yields (pdf_path, signed_file_path, signed_at, error) in completion order
+    so the caller can report progress while the rest are still running.
+    """
+    # Spawned workers would re-run the Streamlit script if they imported
+    # __main__; the pool hides it whenever it launches them.
+    with worker_pool.spawn_pool(max_workers, initializer=_init_worker, initargs=(signature_bytes, certificate)) as pool:
+        futures = {
+            pool.submit(_stamp_in_worker, pdf_path, signed_folder, incremental, name, stage, signer_name): pdf_path
+            for pdf_path, name in zip(pdf_paths, names or [None] * len(pdf_paths))
+        }
+        for future in as_completed(futures):
+            pdf_path = futures[future]
+            try:
+                signed_file_path, signed_at = future.result()
+            except Exception as e:
+                yield pdf_path, None, None, e
+            else:
+                yield pdf_path, signed_file_path, signed_at, None
@@ -0,0 +1,262 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import blob_store
+import lazy_import
+import signing_log
+import timing
+import worker_pool
+from qtg_core import LOG_FILE, discover_sets
+from qtg_index import QTGIndex
+
+fitz = lazy_import.module("fitz")
+pd = lazy_import.module("pandas")
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = os.environ.get("QTG_SEARCH_DB", os.path.join(".qtg_cache", "search.sqlite3"))
+MAX_WORKERS = 2
+# A refresh walks every set; reruns inside this window reuse the last one.
+REFRESH_INTERVAL_S = 30
+RESULT_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    device TEXT,
+    year TEXT,
+    set_name TEXT,
+    state TEXT,
+    name TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5 (body, sha256 UNINDEXED);
+CREATE TABLE IF NOT EXISTS logs (
+    base_folder TEXT PRIMARY KEY,
+    stamp TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS log_text USING fts5 (
+    title, signer, remarks, base_folder UNINDEXED, device UNINDEXED, year UNINDEXED, set_name UNINDEXED
+);
+"""
+
+
+def extract_text(path):
+    """Return (sha256, text) for a PDF; runs in a worker process."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with fitz.open(path) as doc:
+        text = "\n".join(page.get_text() for page in doc)
+    return digest.hexdigest(), text
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+class SearchIndex:
+    """Full-text index over every QTG PDF and signing-log remark under a root.
+
+    Text is stored once per content hash, so copies and files moved between
+    folders are never extracted twice; a file is re-hashed only when its
+    name, size or mtime changes.
+    """
+
+    def __init__(self, root=".", db_path=INDEX_FILE):
+        self.root = root
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshed_at = 0.0
+        self._pool = worker_pool.RespawningPool(MAX_WORKERS)
+        self._indexes = {}
+        self._folders = {}  # (base_folder, state) -> {path: document row} as of the last scan
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def _write(self, statements):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for sql, rows in statements:
+                    self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _index(self, base_folder):
+        if base_folder not in self._indexes:
+            self._indexes[base_folder] = QTGIndex(base_folder)
+        return self._indexes[base_folder]
+
+    def _scan(self):
+        """Every PDF under root, keyed by path, from each set's QTGIndex.
+
+        Reconciling a set costs one stat per folder; only folders whose
+        mtime changed are read again, the rest reuse the last scan.
+        """
+        found = {}
+        for device, year, set_name, base_folder in discover_sets(self.root):
+            index = self._index(base_folder)
+            changed = index.reconcile()
+            for state, folder in index.folders.items():
+                key = (base_folder, state)
+                if state in changed or key not in self._folders:
+                    self._folders[key] = {
+                        os.path.normpath(path): (device, year, set_name, state, os.path.basename(path), size, mtime_ns)
+                        for path, size, mtime_ns in index.entries(folder)
+                        if path.lower().endswith(".pdf")
+                    }
+                found.update(self._folders[key])
+        return found
+
+    def refresh(self):
+        """Bring the index up to date with the tree; return how many PDFs were read."""
+        with self._refresh_lock, timing.span("search.refresh"):
+            found = self._scan()
+            with self._lock:
+                known = {row[0]: row[1:] for row in self.conn.execute(
+                    "SELECT path, name, size, mtime_ns, sha256 FROM documents"
+                )}
+                indexed = {sha256 for (sha256,) in self.conn.execute("SELECT sha256 FROM document_text")}
+            by_version = {row[:3]: row[3] for row in known.values() if row[3]}
+
+            unchanged, rehashed, to_read = [], [], []
+            for path, (device, year, set_name, state, name, size, mtime_ns) in found.items():
+                row = (path, device, year, set_name, state, name, size, mtime_ns)
+                old = known.get(path)
+                if old is not None and old[:3] == (name, size, mtime_ns) and old[3]:
+                    unchanged.append(path)
+                    continue
+                # Same version elsewhere, or the same blob: reuse its text.
+                sha256 = by_version.get((name, size, mtime_ns)) or blob_store.content_hash(path)
+                if sha256 in indexed:
+                    rehashed.append(row + (sha256,))
+                else:
+                    to_read.append(row)
+            self._write([
+                ("DELETE FROM documents WHERE path = ?", [(path,) for path in known.keys() - found.keys()]),
+                ("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rehashed),
+            ])
+
+            if to_read:
+                futures = {self._pool.submit(extract_text, row[0]): row for row in to_read}
+                for future in as_completed(futures):
+                    row = futures[future]
+                    try:
+                        sha256, text = future.result()
+                    except BrokenProcessPool:
+                        log.warning("A search worker died while %s was being read; retrying on the next refresh",
+                                    row[0])
+                        sha256, text = None, None
+                    except Exception:
+                        sha256, text = None, None  # unreadable now; retried on the next refresh
+                    statements = [("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [row + (sha256,)])]
+                    if sha256 is not None and sha256 not in indexed:
+                        indexed.add(sha256)
+                        statements.append(("INSERT INTO document_text VALUES (?, ?)", [(text, sha256)]))
+                    self._write(statements)
+
+            self._write([(
+                "DELETE FROM document_text WHERE sha256 NOT IN "
+                "(SELECT sha256 FROM documents WHERE sha256 IS NOT NULL)",
+                [()],
+            )])
+            self._refresh_logs()
+            self._refreshed_at = time.monotonic()
+            return len(to_read)
+
+    def _refresh_logs(self):
+        with self._lock:
+            stamps = dict(self.conn.execute("SELECT base_folder, stamp FROM logs"))
+        seen = set()
+        for device, year, set_name, base_folder in discover_sets(self.root):
+            log_file = os.path.join(base_folder, LOG_FILE)
+            if not os.path.exists(log_file):
+                continue
+            seen.add(base_folder)
+            stamp = signing_log.log_stamp(log_file)
+            if stamps.get(base_folder) == stamp:
+                continue
+            try:
+                log_data = signing_log.load_log(log_file)
+            except Exception:
+                continue
+            columns = log_data.columns
+            rows = [
+                (*("" if pd.isna(value) else str(value) for value in values), base_folder, device, year, set_name)
+                for values in log_data[[
+                    columns[signing_log.TITLE_COLUMN],
+                    columns[signing_log.SIGNER_COLUMN],
+                    columns[signing_log.REMARKS_COLUMN],
+                ]].itertuples(index=False)
+            ]
+            self._write([
+                ("DELETE FROM log_text WHERE base_folder = ?", [(base_folder,)]),
+                ("INSERT INTO log_text VALUES (?, ?, ?, ?, ?, ?, ?)", rows),
+                ("INSERT OR REPLACE INTO logs VALUES (?, ?)", [(base_folder, stamp)]),
+            ])
+        gone = [(base_folder,) for base_folder in stamps.keys() - seen]
+        self._write([
+            ("DELETE FROM log_text WHERE base_folder = ?", gone),
+            ("DELETE FROM logs WHERE base_folder = ?", gone),
+        ])
+
+    def refresh_in_background(self):
+        """Start a refresh on a daemon thread unless one ran recently or is running."""
+        if self._refresh_lock.locked() or time.monotonic() - self._refreshed_at < REFRESH_INTERVAL_S:
+            return False
+        threading.Thread(target=self._refresh_logged, name="qtg-search-refresh", daemon=True).start()
+        return True
+
+    def _refresh_logged(self):
+        # Nobody joins the background thread, so its errors would vanish.
+        try:
+            self.refresh()
+        except Exception:
+            log.exception("Refreshing the search index failed; retrying in %s s", REFRESH_INTERVAL_S)
+            self._refreshed_at = time.monotonic()
+
+    def search(self, text, limit=RESULT_LIMIT):
+        """Return matching documents and log rows, best first.
+
+        Each hit is (kind, device, year, set_name, state, name, snippet) with
+        kind "pdf" or "log"; log hits have state None and the Test Title as name.
+        """
+        query = fts_query(text)
+        if not query:
+            return []
+        with self._lock, timing.span("search.query"):
+            documents = self.conn.execute(
+                "SELECT 'pdf', d.device, d.year, d.set_name, d.state, d.name, "
+                "snippet(document_text, 0, '**', '**', '…', 12) "
+                "FROM document_text JOIN documents d ON d.sha256 = document_text.sha256 "
+                "WHERE document_text MATCH ? ORDER BY document_text.rank, d.path LIMIT ?",
+                (query, limit),
+            ).fetchall()
+            remarks = self.conn.execute(
+                "SELECT 'log', device, year, set_name, NULL, title, "
+                "snippet(log_text, -1, '**', '**', '…', 12) "
+                "FROM log_text WHERE log_text MATCH ? ORDER BY rank LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        return documents + remarks
+
+    def close(self):
+        self.conn.close()
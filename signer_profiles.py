@@ -0,0 +1,216 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+
+import lazy_import
+import qtg_signing
+
+fitz = lazy_import.module("fitz")
+
+PROFILE_DIR = os.environ.get("QTG_PROFILE_DIR", ".qtg_profiles")
+# Resolution the stamp is stored at; the signature box is printed at most
+# this sharp, so anything larger only costs decode time and file size.
+TARGET_DPI = 200
+JPEG_QUALITY = 90
+EXTENSIONS = (".jpg", ".png")
+CERTIFICATE_EXTENSION = ".p12"
+# Who a profile belongs to: the name it was created under and a salted
+# hash of the PIN chosen then.  Using or replacing it needs that PIN.
+OWNER_EXTENSION = ".owner.json"
+PIN_ITERATIONS = 200_000
+MIN_PIN_LENGTH = 4
+
+_lock = threading.Lock()
+_decoded = {}  # profile path -> (mtime_ns, stored bytes, insertable signature)
+_verified = set()  # (PIN hash, digest of the PIN entered) already checked
+
+
+class ProfileLocked(PermissionError):
+    pass
+
+
+def _profile_base(signer_name):
+    slug = re.sub(r"[^a-z0-9_.-]+", "_", signer_name.strip().lower()).strip("._")
+    if not slug:
+        raise ValueError("Signer name must contain letters or digits.")
+    return os.path.join(PROFILE_DIR, slug)
+
+
+def _profile_path(signer_name):
+    base = _profile_base(signer_name)
+    for extension in EXTENSIONS:
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
+
+
+def _fit_to_stamp(pixmap):
+    # One stored signature serves every stage, so fit the largest stage box.
+    sizes = [qtg_signing.stamp_size(stage) for stage in qtg_signing.STAGES]
+    max_width = round(max(width for width, _ in sizes) / 72 * TARGET_DPI)
+    max_height = round(max(height for _, height in sizes) / 72 * TARGET_DPI)
+    scale = min(max_width / pixmap.width, max_height / pixmap.height, 1)
+    if scale < 1:
+        pixmap = fitz.Pixmap(pixmap, max(1, round(pixmap.width * scale)), max(1, round(pixmap.height * scale)), None)
+    return pixmap
+
+
+def _normalized(signer_name):
+    return " ".join(signer_name.split()).casefold()
+
+
+def _owner_path(signer_name):
+    return _profile_base(signer_name) + OWNER_EXTENSION
+
+
+def _owner(signer_name):
+    try:
+        with open(_owner_path(signer_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _pin_hash(pin, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", pin.encode("utf-8"), bytes.fromhex(salt), iterations).hex()
+
+
+def _check(signer_name, pin):
+    """The owner record if pin opens this profile, None if it has no owner."""
+    owner = _owner(signer_name)
+    if owner is None:
+        return None
+    if _normalized(owner["name"]) != _normalized(signer_name):
+        # Different names that map to the same file name.
+        raise ProfileLocked(f"'{signer_name}' is too close to the saved signer '{owner['name']}'; use another name.")
+    key = (owner["hash"], hashlib.sha256(pin.encode("utf-8")).hexdigest())
+    with _lock:
+        if key in _verified:
+            return owner
+    if not hmac.compare_digest(_pin_hash(pin, owner["salt"], owner["iterations"]), owner["hash"]):
+        raise ProfileLocked(f"Wrong PIN for {owner['name']}.")
+    with _lock:
+        _verified.add(key)
+    return owner
+
+
+def _create_owner(signer_name, pin):
+    salt = os.urandom(16).hex()
+    record = {"name": signer_name.strip(), "salt": salt, "iterations": PIN_ITERATIONS,
+              "hash": _pin_hash(pin, salt, PIN_ITERATIONS)}
+    fd, tmp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f)
+        # A link fails instead of replacing, so of two first uploads only one wins.
+        os.link(tmp_path, _owner_path(signer_name))
+    finally:
+        os.remove(tmp_path)
+
+
+def verify_pin(signer_name, pin):
+    """Raise ProfileLocked unless pin opens signer_name's saved profile.
+
+    Profiles saved before PINs existed have no owner yet; they are locked
+    until their signer uploads the signature again and chooses a PIN.
+    """
+    if _check(signer_name, pin) is None:
+        raise ProfileLocked(f"No PIN is set for {signer_name}; upload your signature again to choose one.")
+
+
+def has_profile(signer_name):
+    try:
+        return _profile_path(signer_name) is not None
+    except ValueError:
+        return False
+
+
+def save_profile(signer_name, image_bytes, pin):
+    """Store a signer's signature, downsampled to the stamp size.
+
+    Opaque signatures are kept as JPEG, which PDFs embed without decoding;
+    transparent ones as PNG.  A new profile is locked with pin; replacing
+    an existing one needs the PIN it was locked with.
+    """
+    if len(pin) < MIN_PIN_LENGTH:
+        raise ValueError(f"Choose a PIN of at least {MIN_PIN_LENGTH} characters.")
+    pixmap = fitz.Pixmap(image_bytes)
+    if pixmap.colorspace and pixmap.colorspace.n not in (1, 3):
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    pixmap = _fit_to_stamp(pixmap)
+    if pixmap.alpha:
+        extension, data = ".png", pixmap.tobytes("png")
+    else:
+        extension, data = ".jpg", pixmap.tobytes("jpg", jpg_quality=JPEG_QUALITY)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = _profile_base(signer_name)
+    if _check(signer_name, pin) is None:
+        try:
+            _create_owner(signer_name, pin)
+        except FileExistsError:
+            _check(signer_name, pin)
+    fd, tmp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, base + extension)
+    for stale in EXTENSIONS:
+        if stale != extension and os.path.exists(base + stale):
+            os.remove(base + stale)
+    return base + extension
+
+
+def certificate_path(signer_name):
+    """The signer's saved PKCS#12 file, or None."""
+    try:
+        path = _profile_base(signer_name) + CERTIFICATE_EXTENSION
+    except ValueError:
+        return None
+    return path if os.path.exists(path) else None
+
+
+def save_certificate(signer_name, pkcs12_bytes, pin):
+    """Store a signer's PKCS#12 file as is; its passphrase is never stored.
+
+    The signer's profile must exist and pin must open it.
+    """
+    verify_pin(signer_name, pin)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = _profile_base(signer_name) + CERTIFICATE_EXTENSION
+    fd, tmp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".tmp")
+    os.chmod(tmp_path, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pkcs12_bytes)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _load(signer_name):
+    path = _profile_path(signer_name)
+    if path is None:
+        raise FileNotFoundError(f"No saved signature for {signer_name}.")
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _decoded.get(path)
+        if cached is None or cached[0] != mtime_ns:
+            with open(path, "rb") as f:
+                data = f.read()
+            cached = _decoded[path] = (mtime_ns, data, qtg_signing.insertable_signature(data))
+    return cached
+
+
+def signature_bytes(signer_name):
+    """The stored image, e.g. to display or to hand to worker processes once.
+
+    Neither this nor signature_stamp() checks the PIN; callers acting for
+    a person (the app, the CLI) call verify_pin() first.
+    """
+    return _load(signer_name)[1]
+
+
+def signature_stamp(signer_name):
+    """The signature prepared once for qtg_signing.stamp_pdf."""
+    return _load(signer_name)[2]
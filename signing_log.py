@@ -0,0 +1,381 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import file_locks
+import lazy_import
+import timing
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single O_APPEND write is the best we get
+    fcntl = None
+
+pd = lazy_import.module("pandas")
+openpyxl = lazy_import.module("openpyxl")
+if lazy_import.installed("pyarrow"):
+    pa = lazy_import.module("pyarrow")
+    pq = lazy_import.module("pyarrow.parquet")
+else:
+    pa = pq = None
+
+JOURNAL_FILE = "signing_journal.jsonl"
+APPLIED_FILE = ".signing_journal.applied"
+SIDECAR_FILE = ".signing_log.parquet"
+SIDECAR_KEY = b"qtg_source_stat"
+
+# Columns of signing_log.xlsx (0-based) that a signature fills in.
+TITLE_COLUMN = 1
+REMARKS_COLUMN = 10
+# Filled in by hand: PASS or FAIL once the test has been run.
+STATUS_COLUMN = 7
+# The signer and date columns of each review stage, in signing order.
+# Journal records from before stages existed have none and belong to the
+# first.  CAE keeps "Validated By ETIHAD" / "Check Date" (8, 9) because
+# every signature the app wrote before there were stages is in those
+# columns; EAT takes the other signer pair, "Verified By TCOPS" (5, 6).
+# Sites whose sheets assign them the other way round set
+# QTG_STAGE_COLUMNS, e.g. '{"CAE": [5, 6], "EAT": [8, 9]}'.
+DEFAULT_STAGE_COLUMNS = {"CAE": (8, 9), "EAT": (5, 6)}
+
+
+def _stage_columns(value):
+    if not value:
+        return DEFAULT_STAGE_COLUMNS
+    columns = {stage: tuple(pair) for stage, pair in json.loads(value).items()}
+    used = [column for pair in columns.values() for column in pair]
+    if set(columns) != set(DEFAULT_STAGE_COLUMNS) or any(len(pair) != 2 for pair in columns.values()) or (
+        not all(isinstance(column, int) for column in used) or len(set(used)) != len(used)
+    ):
+        raise ValueError(
+            f"QTG_STAGE_COLUMNS must map {sorted(DEFAULT_STAGE_COLUMNS)} to distinct [signer, date] columns."
+        )
+    # Signing order is fixed; only the columns are configurable.
+    return {stage: columns[stage] for stage in DEFAULT_STAGE_COLUMNS}
+
+
+STAGE_COLUMNS = _stage_columns(os.environ.get("QTG_STAGE_COLUMNS"))
+FIRST_STAGE = "CAE"
+SIGNER_COLUMN, DATE_COLUMN = STAGE_COLUMNS[FIRST_STAGE]
+
+# How often materialize() starts over when the xlsx changes under it,
+# e.g. because someone saved it from Excel.
+MATERIALIZE_ATTEMPTS = 3
+
+
+def journal_path(excel_path):
+    return os.path.join(os.path.dirname(excel_path), JOURNAL_FILE)
+
+
+def _applied_path(excel_path):
+    return os.path.join(os.path.dirname(excel_path), APPLIED_FILE)
+
+
+def _sidecar_path(excel_path):
+    return os.path.join(os.path.dirname(excel_path), SIDECAR_FILE)
+
+
+class _GroupCommitWriter:
+    """Appends journal lines from many threads with one fsync per batch.
+
+    Callers block until their lines are durable.  Whatever arrives while a
+    batch is being written is committed together in the next one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cond = threading.Condition()
+        self._pending = []
+        self._submitted = 0
+        self._durable = 0
+        self._errors = {}
+        threading.Thread(target=self._run, name=f"journal-writer:{path}", daemon=True).start()
+
+    def append(self, data):
+        with self._cond:
+            self._pending.append(data)
+            self._submitted += 1
+            ticket = self._submitted
+            self._cond.notify_all()
+            while self._durable < ticket:
+                self._cond.wait()
+            error = self._errors.pop(ticket, None)
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                first, last = self._durable + 1, self._submitted
+            error = None
+            try:
+                self._write(b"".join(batch))
+            except Exception as e:
+                # Whatever went wrong goes to the waiting callers; if this
+                # thread died instead, every later append() would hang.
+                error = e
+            with self._cond:
+                if error is not None:
+                    for ticket in range(first, last + 1):
+                        self._errors[ticket] = error
+                self._durable = last
+                self._cond.notify_all()
+
+    def _write(self, data):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def _writer_for(path):
+    path = os.path.abspath(path)
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = _GroupCommitWriter(path)
+        return _writers[path]
+
+
+def append_entries(excel_path, entries, stage=FIRST_STAGE):
+    """Durably record (file_name, signer_name, signing_date, remarks) entries for a stage."""
+    lines = [
+        json.dumps({
+            "file_name": file_name, "signer_name": signer_name, "signing_date": signing_date, "remarks": remarks,
+            "stage": stage,
+        })
+        + "\n"
+        for file_name, signer_name, signing_date, remarks in entries
+    ]
+    if lines:
+        with timing.span("journal.append"):
+            _writer_for(journal_path(excel_path)).append("".join(lines).encode("utf-8"))
+
+
+def read_journal(excel_path, offset=0):
+    """Return the journal records after offset and the offset they end at.
+
+    A trailing line without a newline is an append still in flight and is
+    left for the next read.
+    """
+    try:
+        with open(journal_path(excel_path), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return records, offset + end
+
+
+def applied_offset(excel_path):
+    """How far into the journal the xlsx already reflects."""
+    try:
+        with open(_applied_path(excel_path)) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def log_stamp(excel_path):
+    """A string that changes whenever the xlsx or its journal does."""
+    stamp = []
+    for path in (excel_path, journal_path(excel_path)):
+        try:
+            stamp.append(_stat_key(path))
+        except FileNotFoundError:
+            stamp.append(None)
+    return json.dumps(stamp)
+
+
+def _normalize(frame):
+    # Hand-edited logs mix dates, numbers and text in one column; keep such
+    # columns as text so the xlsx and the Arrow sidecar read back identically.
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = frame[column].map(lambda value: value if pd.isna(value) else str(value))
+    return frame
+
+
+def _read_sidecar(excel_path, key):
+    if pq is None:
+        return None
+    try:
+        metadata = pq.read_schema(_sidecar_path(excel_path)).metadata or {}
+        if json.loads(metadata.get(SIDECAR_KEY, b"null")) != key:
+            return None
+        return pq.read_table(_sidecar_path(excel_path)).to_pandas()
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+
+
+def _write_sidecar(excel_path, key, frame):
+    if pa is None:
+        return
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SIDECAR_KEY: json.dumps(key)})
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(excel_path) or ".", suffix=".parquet")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, _sidecar_path(excel_path))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except (OSError, ValueError, pa.ArrowException):
+        pass
+
+
+_frame_cache = {}
+_frame_lock = threading.Lock()
+
+
+def read_log_frame(excel_path):
+    """Parse the xlsx log, reusing earlier parses while its mtime and size hold.
+
+    Parses are cached in memory and in an Arrow (Parquet) sidecar next to the
+    xlsx, so a fresh process skips openpyxl too.  The returned frame is shared
+    and must not be modified.
+    """
+    key = _stat_key(excel_path)
+    with _frame_lock:
+        cached = _frame_cache.get(excel_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    with timing.span("parquet.read"):
+        frame = _read_sidecar(excel_path, key)
+    if frame is None:
+        with timing.span("pd.read_excel"):
+            frame = _normalize(pd.read_excel(excel_path))
+        with timing.span("parquet.write"):
+            _write_sidecar(excel_path, key, frame)
+    with _frame_lock:
+        _frame_cache[excel_path] = (key, frame)
+    return frame
+
+
+def log_file_names(excel_path):
+    """Return the set of file names listed in the xlsx log."""
+    titles = read_log_frame(excel_path).iloc[:, TITLE_COLUMN]
+    return set(titles.dropna())
+
+
+def record_stage(record):
+    return record.get("stage") or FIRST_STAGE
+
+
+def _fills(record):
+    """The (column, value) pairs a journal record writes into its row.
+
+    A later stage without remarks keeps the ones already there.
+    """
+    signer_column, date_column = STAGE_COLUMNS[record_stage(record)]
+    fills = [(signer_column, record["signer_name"]), (date_column, record["signing_date"])]
+    if record["remarks"] or record_stage(record) == FIRST_STAGE:
+        fills.append((REMARKS_COLUMN, record["remarks"]))
+    return fills
+
+
+def pending_entries(excel_path):
+    """Journal records that have not been written into the xlsx yet."""
+    return read_journal(excel_path, applied_offset(excel_path))[0]
+
+
+def load_log(excel_path):
+    """Read the xlsx log with any not-yet-materialized signatures applied."""
+    log_data = read_log_frame(excel_path).copy()
+    records = pending_entries(excel_path)
+    if records:
+        columns = log_data.columns
+        filled = [columns[column] for pair in STAGE_COLUMNS.values() for column in pair] + [columns[REMARKS_COLUMN]]
+        log_data[filled] = log_data[filled].astype(object)
+        titles = log_data[columns[TITLE_COLUMN]]
+        for record in records:
+            for column, value in _fills(record):
+                log_data.loc[titles == record["file_name"], columns[column]] = value
+    return log_data
+
+
+class LogChanged(RuntimeError):
+    def __init__(self, excel_path):
+        super().__init__(f"{os.path.basename(excel_path)} kept changing while the journal was applied; try again.")
+
+
+def materialize(excel_path):
+    """Apply pending journal records to the xlsx; return how many were applied.
+
+    Writers are serialized by a lock file next to the log.  The workbook is
+    written to a temporary file and swapped in only if the xlsx is still the
+    version that was read; otherwise the merge is redone on the new one.
+    Re-applying a record is harmless, so a crash between the swap and the
+    offset update only repeats work.
+    """
+    with file_locks.LockFile(file_locks.lock_path(excel_path)):
+        for _ in range(MATERIALIZE_ATTEMPTS):
+            applied = _materialize_once(excel_path)
+            if applied is not None:
+                return applied
+    raise LogChanged(excel_path)
+
+
+def _materialize_once(excel_path):
+    records, end = read_journal(excel_path, applied_offset(excel_path))
+    if not records:
+        return 0
+    version = _stat_key(excel_path)
+    latest = {}
+    for record in records:
+        latest.setdefault(record["file_name"], {})[record_stage(record)] = record
+    with timing.span("load_workbook"):
+        workbook = openpyxl.load_workbook(excel_path)
+    try:
+        for row in workbook.active.iter_rows(min_row=2):
+            for record in latest.get(row[TITLE_COLUMN].value, {}).values():
+                for column, value in _fills(record):
+                    row[column].value = value
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(excel_path) or ".", suffix=".xlsx")
+        os.close(fd)
+        try:
+            with timing.span("workbook.save"):
+                workbook.save(tmp_path)
+            if _stat_key(excel_path) != version:
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, excel_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        workbook.close()
+    with open(_applied_path(excel_path), "w") as f:
+        f.write(str(end))
+    return len(records)
+
+
+if __name__ == "__main__":
+    # Scheduled regeneration, e.g. from cron: python signing_log.py FFS/2024/*/signing_log.xlsx
+    for path in sys.argv[1:]:
+        print(f"{path}: applied {materialize(path)} journal entries")
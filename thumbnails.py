@@ -0,0 +1,209 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import blob_store
+import lazy_import
+import worker_pool
+
+fitz = lazy_import.module("fitz")
+
+CACHE_DIR = os.environ.get("QTG_THUMB_DIR", os.path.join(".qtg_cache", "thumbnails"))
+BUDGET_BYTES = int(os.environ.get("QTG_THUMB_BUDGET_BYTES", str(256 * 1024 * 1024)))
+THUMB_WIDTH = 240
+MAX_WORKERS = 2
+# The in-app viewer renders pages at these multiples of 72 dpi and renders
+# this many pages ahead of the one being read.
+PAGE_ZOOMS = (1.0, 1.5, 2.0)
+PREFETCH_PAGES = 3
+
+_lock = threading.RLock()
+_pool = worker_pool.RespawningPool(MAX_WORKERS)
+_in_flight = set()
+_failed = set()  # keys of PDF versions that could not be rendered
+_cache_bytes = None
+
+
+def thumbnail_key(path, size, mtime_ns):
+    # Identical PDFs in the blob store share one thumbnail.
+    content = blob_store.content_hash(path)
+    if content:
+        return content
+    raw = f"{os.path.abspath(path)}\0{size}\0{mtime_ns}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _thumb_path(key):
+    return os.path.join(CACHE_DIR, key + ".png")
+
+
+def _marker_path(key):
+    return os.path.join(CACHE_DIR, key + ".rendering")
+
+
+def page_key(path, size, mtime_ns, page_number, zoom):
+    return f"{thumbnail_key(path, size, mtime_ns)}-p{page_number}-z{zoom:g}"
+
+
+def _read_cached(key):
+    thumb_path = _thumb_path(key)
+    try:
+        with open(thumb_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(thumb_path)  # mark as recently used for LRU eviction
+    except OSError:
+        pass
+    return data
+
+
+def cached_thumbnail(path, size, mtime_ns):
+    """Return the cached PNG for a PDF version, or None; never decodes the PDF."""
+    return _read_cached(thumbnail_key(path, size, mtime_ns))
+
+
+def failed_thumbnail(path, size, mtime_ns):
+    """Whether rendering this PDF version failed; it is not tried again."""
+    return thumbnail_key(path, size, mtime_ns) in _failed
+
+
+def _write_cached(key, png):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(png)
+    os.replace(tmp_path, _thumb_path(key))
+    return len(png)
+
+
+def _render(path, page_number, zoom=None):
+    doc = fitz.open(path)
+    try:
+        page = doc[page_number]
+        zoom = zoom or THUMB_WIDTH / page.rect.width
+        return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes("png")
+    finally:
+        doc.close()
+
+
+def _render_marked(key, path, page_number, zoom=None):
+    # The marker outlives a worker that crashes while rendering, which is
+    # how _done() tells the culprit from the rest of a broken pool's work.
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    open(_marker_path(key), "w").close()
+    try:
+        return _write_cached(key, _render(path, page_number, zoom))
+    finally:
+        os.remove(_marker_path(key))
+
+
+def render_thumbnail(path, key):
+    """Render page 0 of a PDF into the cache; return the bytes written."""
+    return _render_marked(key, path, 0)
+
+
+def render_page(path, page_number, zoom, key):
+    """Render one page for the viewer into the cache; return the bytes written."""
+    return _render_marked(key, path, page_number, zoom)
+
+
+def _scan_cache():
+    entries = []
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                if entry.name.endswith(".png"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _evict():
+    """Drop least recently used thumbnails until the cache fits its budget."""
+    global _cache_bytes
+    entries = sorted(_scan_cache())
+    total = sum(size for _, size, _ in entries)
+    for _, size, thumb_path in entries:
+        if total <= BUDGET_BYTES:
+            break
+        try:
+            os.remove(thumb_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    _cache_bytes = total
+
+
+def _account(written):
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _scan_cache())
+        else:
+            _cache_bytes += written
+        if _cache_bytes > BUDGET_BYTES:
+            _evict()
+
+
+def _done(key, future):
+    error = None if future.cancelled() else future.exception()
+    failed = error is not None
+    if isinstance(error, BrokenProcessPool):
+        # Only the render whose worker died is to blame; the rest of the
+        # pool's work is queued again by the next prewarm.
+        try:
+            os.remove(_marker_path(key))
+        except FileNotFoundError:
+            failed = False
+    with _lock:
+        _in_flight.discard(key)
+        if failed:
+            _failed.add(key)
+    if error is None and not future.cancelled():
+        _account(future.result())
+
+
+def _submit(key, render, *args):
+    """Queue a background render unless it is cached, queued or failed before.
+
+    Call with _lock held.  Never raises: a render that cannot be queued
+    now is queued again by the next prewarm.
+    """
+    if key in _in_flight or key in _failed or os.path.exists(_thumb_path(key)):
+        return
+    try:
+        future = _pool.submit(render, *args, key)
+    except (RuntimeError, OSError):
+        return
+    _in_flight.add(key)
+    future.add_done_callback(lambda f, key=key: _done(key, f))
+
+
+def prewarm(entries):
+    """Queue background renders for (path, size, mtime_ns) entries not yet cached."""
+    with _lock:
+        for path, size, mtime_ns in entries:
+            _submit(thumbnail_key(path, size, mtime_ns), render_thumbnail, path)
+
+
+def page_image(path, size, mtime_ns, page_number, zoom, page_count=None):
+    """Return one page as PNG, rendering it now if needed, and prefetch the next ones.
+
+    Only the requested page is decoded; the PDF itself never leaves the server.
+    """
+    key = page_key(path, size, mtime_ns, page_number, zoom)
+    png = _read_cached(key)
+    if png is None:
+        png = _render(path, page_number, zoom)
+        _account(_write_cached(key, png))
+    last = page_number + PREFETCH_PAGES if page_count is None else min(page_number + PREFETCH_PAGES, page_count - 1)
+    with _lock:
+        for ahead in range(page_number + 1, last + 1):
+            _submit(page_key(path, size, mtime_ns, ahead, zoom), render_page, path, ahead, zoom)
+    return png
@@ -0,0 +1,155 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+
+SINK_DIR = os.environ.get("QTG_TIMING_DIR", os.path.join(".qtg_cache", "timing"))
+SINKS_ENABLED = os.environ.get("QTG_TIMING", "1") != "0"
+JSONL_FILE = "reruns.jsonl"
+# reruns.jsonl is rotated to reruns.jsonl.1 at this size, so the sink
+# keeps at most twice this much on disk.
+JSONL_MAX_BYTES = int(os.environ.get("QTG_TIMING_MAX_BYTES", str(16 * 1024 * 1024)))
+PROM_FILE = "qtg_timing.prom"
+PROM_INTERVAL_S = 10
+SAMPLES_KEPT = 1000
+QUANTILES = (0.5, 0.9, 0.99)
+
+_current = contextvars.ContextVar("qtg_timing_run", default=None)
+_lock = threading.Lock()
+_samples = collections.defaultdict(lambda: collections.deque(maxlen=SAMPLES_KEPT))
+_totals = collections.defaultdict(lambda: [0, 0.0])  # (op, set) -> [count, sum]
+_prom_written = 0.0
+
+
+class Run:
+    """The spans recorded during one script run."""
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.spans = []
+        self.finished = False
+
+    def summary(self):
+        """Per-operation (name, calls, total seconds), slowest first."""
+        totals = collections.defaultdict(lambda: [0, 0.0])
+        for name, duration in self.spans:
+            totals[name][0] += 1
+            totals[name][1] += duration
+        return sorted(((name, calls, seconds) for name, (calls, seconds) in totals.items()),
+                      key=lambda row: -row[2])
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time a block and attribute it to the current run, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run = _current.get()
+        if run is not None:
+            now = time.perf_counter()
+            run.spans.append((name, now - start))
+            run.end = now
+
+
+def begin_run(labels, previous=None):
+    """Start collecting spans for this thread's script run.
+
+    A previous run that never reached finish_run() (st.rerun() and st.stop()
+    end a run early) is finished first, timed up to its last span.
+    """
+    if previous is not None and not previous.finished:
+        finish_run(previous)
+    run = Run(labels)
+    _current.set(run)
+    return run
+
+
+def finish_run(run):
+    if run.finished:
+        return
+    run.finished = True
+    if run is _current.get():
+        run.end = time.perf_counter()
+    total = run.end - run.start
+    set_label = run.labels.get("set", "")
+    summary = run.summary()
+    # A fragment rerunning on its own and a background job are totalled
+    # apart from full reruns.
+    if run.labels.get("fragment"):
+        total_name = f"{run.labels['fragment']}.rerun_total"
+    elif run.labels.get("job"):
+        total_name = f"job.{run.labels['job']}.total"
+    else:
+        total_name = "rerun_total"
+    with _lock:
+        for name, _, seconds in summary + [(total_name, 1, total)]:
+            _samples[(name, set_label)].append(seconds)
+            _totals[(name, set_label)][0] += 1
+            _totals[(name, set_label)][1] += seconds
+    if SINKS_ENABLED:
+        _write_sinks(run, total, summary)
+
+
+def percentiles(set_label=None):
+    """Rows of (op, set, count, p50, p90, p99) over the recent samples."""
+    rows = []
+    with _lock:
+        for (name, label), samples in sorted(_samples.items()):
+            if set_label is not None and label != set_label:
+                continue
+            ordered = sorted(samples)
+            rows.append((name, label, _totals[(name, label)][0],
+                         *(ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES)))
+    return rows
+
+
+def _write_sinks(run, total, summary):
+    global _prom_written
+    record = {
+        "ts": time.time(),
+        **run.labels,
+        "total_s": round(total, 6),
+        "spans": {name: {"calls": calls, "s": round(seconds, 6)} for name, calls, seconds in summary},
+    }
+    try:
+        os.makedirs(SINK_DIR, exist_ok=True)
+        jsonl_path = os.path.join(SINK_DIR, JSONL_FILE)
+        with open(jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            full = f.tell() >= JSONL_MAX_BYTES
+        if full:
+            os.replace(jsonl_path, jsonl_path + ".1")
+        if time.monotonic() - _prom_written >= PROM_INTERVAL_S:
+            _prom_written = time.monotonic()
+            _write_prometheus()
+    except OSError:
+        pass  # timing must never break the app
+
+
+def _write_prometheus():
+    lines = [
+        "# HELP qtg_operation_seconds Time spent in QTG hot-path operations per rerun.",
+        "# TYPE qtg_operation_seconds summary",
+    ]
+    with _lock:
+        for (name, label), samples in sorted(_samples.items()):
+            ordered = sorted(samples)
+            labels = f'op="{name}",set="{label}"'
+            for q in QUANTILES:
+                value = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                lines.append(f'qtg_operation_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            count, seconds = _totals[(name, label)]
+            lines.append(f"qtg_operation_seconds_sum{{{labels}}} {seconds:.6f}")
+            lines.append(f"qtg_operation_seconds_count{{{labels}}} {count}")
+    fd, tmp_path = tempfile.mkstemp(dir=SINK_DIR, suffix=".prom.tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, os.path.join(SINK_DIR, PROM_FILE))
@@ -0,0 +1,74 @@
+import contextlib
+import multiprocessing
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class _SpawnPool(ProcessPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        # Workers are launched from submit(), so that is where __main__
+        # has to be hidden; callers cannot forget to.
+        with hidden_main():
+            return super().submit(fn, *args, **kwargs)
+
+
+def spawn_pool(max_workers=None, initializer=None, initargs=()):
+    """Create a process pool whose workers start clean on every platform.
+
+    Its workers never import the Streamlit script, see hidden_main().
+    """
+    return _SpawnPool(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+class RespawningPool:
+    """A spawn pool, started on first use, that starts over when a worker dies.
+
+    A worker killed by a crash in native code or by the OOM killer breaks
+    a ProcessPoolExecutor for good: its pending futures fail with
+    BrokenProcessPool and so does every later submit().  Long-lived
+    background pools use this instead, so one bad PDF costs only the
+    work that was in flight.
+    """
+
+    def __init__(self, max_workers=None):
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self._pool is None:
+                self._pool = spawn_pool(self._max_workers)
+            try:
+                return self._pool.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = spawn_pool(self._max_workers)
+                return self._pool.submit(fn, *args, **kwargs)
+
+
+@contextlib.contextmanager
+def hidden_main():
+    """Stop spawned workers from re-running the Streamlit script.
+
+    Streamlit installs the running script as sys.modules["__main__"] and
+    spawn re-imports __main__ in every new worker, which would execute the
+    whole app there.  Workers only need the helper modules, which they
+    import by name.
+    """
+    saved = sys.modules.get("__main__")
+    placeholder = types.ModuleType("__main__")
+    sys.modules["__main__"] = placeholder
+    try:
+        yield
+    finally:
+        if sys.modules.get("__main__") is placeholder:
+            sys.modules["__main__"] = saved